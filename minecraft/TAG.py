@@ -37,6 +37,9 @@ class Base(ABC):
     Lowest goes first
     """
     
+    _modified = False
+    """Whether this tag changed since it was last marked clean"""
+    
     @property
     def bit_length(self):
         """Returns the BIT length of this tag's value after encoding"""
@@ -60,7 +63,10 @@ class Base(ABC):
 
     @classmethod
     def from_bytes(cls, iterable):
-        """Create a tag from an iterable of NBT data bytes"""
+        """Create a tag from an iterable of NBT data bytes
+        
+        Bytes are consumed one by one, so <iterable> can be a stream of decompressed data
+        """
         return cls(cls.decode(iterable))
     
     @classmethod
@@ -73,7 +79,23 @@ class Base(ABC):
         - <pos> is the character index following this tag's snbt
         """
         pass
+    
+    def iter_encode(self):
+        """Generate NBT data of self in blocks, see to_bytes
+        
+        Containers yield their elements one by one, so that all of it is never in memory at once
+        """
+        yield self.to_bytes()
 
+    def mark_clean(self):
+        """Mark this tag as unchanged, for example after loading or saving it"""
+        self._modified = False
+    
+    @property
+    def modified(self):
+        """Whether this tag changed since it was last marked clean"""
+        return self._modified
+    
     def to_bytes(self):
         """Return NBT data bytearray from self"""
         return self.encode(self.value)
@@ -108,6 +130,7 @@ class Base(ABC):
         except Exception as e:
             raise type(e)(str(e) + f'(Invalid value {newValue} for {type(self)})')
         self._value = newValue
+        self._modified = True
 
     def __eq__(self, other):
         try:
@@ -242,6 +265,7 @@ class Integer(Number):
     def unsigned(self, newValue):
         newValue = struct.pack(self.fmt.upper(), self.valueType(newValue))
         self._value = self.decode(newValue)
+        self._modified = True
 
 util.make_wrappers( Integer,
     coercedMethods = [
@@ -300,6 +324,7 @@ class MutableSequence(Sequence, collections.abc.MutableSequence):
 
     def append(self, value):
         self.value.append(self.elementType(value))
+        self._modified = True
 
     @classmethod
     def decode(cls, iterable):
@@ -363,8 +388,42 @@ class MutableSequence(Sequence, collections.abc.MutableSequence):
     def insert(self, key, value):
         self.value = self[:key] + [value] + self[key:]
     
+    def mark_clean(self):
+        """Mark this tag and all contained tags as unchanged"""
+        self._modified = False
+        for element in self.value:
+            element.mark_clean()
+    
+    @property
+    def modified(self):
+        """Whether this tag or any contained tag changed since it was last marked clean"""
+        return self._modified or any(element.modified for element in self.value)
+    
     def sort(self, *, key=None, reverse=False):
         self.value.sort(key=key, reverse=reverse)
+        self._modified = True
+    
+    @property
+    def values(self):
+        """List of the values of all elements, to work on a whole array of numbers at once"""
+        return [element.value for element in self.value]
+    
+    @values.setter
+    def values(self, newValues):
+        """Set the values of all elements at once, in place
+        
+        Values are not checked one by one, so <newValues> must already fit in elementType,
+        for example by coming from struct.unpack with its format
+        """
+        newValues = list(newValues)
+        
+        if len(newValues) != len(self.value):
+            raise ValueError(f'Expected {len(self.value)} values, not {len(newValues)}')
+        
+        for element, newValue in zip(self.value, newValues):
+            element._value = newValue
+        
+        self._modified = True
     
     def to_snbt(self):
         return f'[{self.prefix}{",".join( [i.to_snbt() for i in self.value] )}]'
@@ -374,6 +433,7 @@ class MutableSequence(Sequence, collections.abc.MutableSequence):
 
     def __delitem__(self, key):
         del self.value[key]
+        self._modified = True
 
 
     def __setitem__(self, key, value):
@@ -382,6 +442,7 @@ class MutableSequence(Sequence, collections.abc.MutableSequence):
         Value must be able to convert to self.elementType
         """
         self.value[key] = self.elementType(value)
+        self._modified = True
 
 util.make_wrappers( MutableSequence,
     coercedMethods = [
@@ -470,6 +531,26 @@ class MutableMapping(Base, collections.abc.MutableMapping):
             
         return byteValue
 
+    def iter_encode(self):
+        for key, element in self.value.items():
+            
+            yield Byte.encode(element.ID) + String.encode(key)
+            yield from element.iter_encode()
+            
+            if isinstance(element, Compound):
+                yield End.encode()
+    
+    def mark_clean(self):
+        """Mark this tag and all contained tags as unchanged"""
+        self._modified = False
+        for element in self.value.values():
+            element.mark_clean()
+    
+    @property
+    def modified(self):
+        """Whether this tag or any contained tag changed since it was last marked clean"""
+        return self._modified or any(element.modified for element in self.value.values())
+    
     def to_snbt(self):
 
         pairs = []
@@ -481,6 +562,10 @@ class MutableMapping(Base, collections.abc.MutableMapping):
         
         return f'{{{",".join(pairs)}}}'
     
+    def __delitem__(self, key):
+        del self.value[key]
+        self._modified = True
+    
     def __setitem__(self, key, value):
         """Replace self[key] with <value>
         
@@ -498,10 +583,11 @@ class MutableMapping(Base, collections.abc.MutableMapping):
             raise ValueError(f'{type(self)} can only contain other TAGs, not {type(value)}')
     
         self.value[key] = value
+        self._modified = True
 
     
 util.make_wrappers( MutableMapping,
-    nonCoercedMethods = ['keys', '__delitem__', '__getitem__', '__iter__', '__len__']
+    nonCoercedMethods = ['keys', '__getitem__', '__iter__', '__len__']
 )
 #---------------------------------------- Concrete Classes -----------------------------------------
 
@@ -714,6 +800,7 @@ class List(MutableSequence):
         """Append to the list, perform type checking unless it is empty"""
         if self.elementType == End and isinstance(value, Base):
             self.value.append(value)
+            self._modified = True
         elif self.elementType != End:
             super().append(value)
         else:
@@ -732,6 +819,22 @@ class List(MutableSequence):
         ID = value[0].ID if len(value) > 0 else 0
         return Byte.encode(ID) + super().encode(value)
     
+    def iter_encode(self):
+        
+        if not issubclass(self.elementType, (MutableMapping, MutableSequence)):
+            # Elements are too small to be worth encoding one by one
+            yield self.to_bytes()
+            return
+        
+        yield Byte.encode(self.elementID) + Int.encode(len(self))
+        
+        for element in self.value:
+            
+            yield from element.iter_encode()
+            
+            if isinstance(element, Compound):
+                yield End.encode()
+
 class Compound(MutableMapping):
     """A Tag dictionary, containing other named tags of any type."""
     __slots__ = ['_value']
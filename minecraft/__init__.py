@@ -5,5 +5,6 @@ from .datfile import DatFile
 from .mcafile import McaFile
 from .merge_worlds import fuse
 from .world import World
+import minecraft.benchmark as benchmark
 import minecraft.TAG as TAG
 import minecraft.update as update
\ No newline at end of file
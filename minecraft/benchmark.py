@@ -0,0 +1,469 @@
+from .chunk import Chunk
+from .compression import decompress
+from .datfile import DatFile
+from .mcafile import McaFile
+from .merge_worlds import find_offsets, fuse
+from .world import World
+from .world.dimension import Dimension
+import contextlib
+import json
+import logging
+import math
+import minecraft.TAG as TAG
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import util
+
+colors = [
+    'white', 'orange', 'magenta', 'light_blue', 'yellow', 'lime', 'pink', 'gray',
+    'light_gray', 'cyan', 'purple', 'blue', 'brown', 'green', 'red', 'black'
+]
+
+blockNames = [
+    'minecraft:air', 'minecraft:stone', 'minecraft:dirt', 'minecraft:gravel', 'minecraft:sand',
+    'minecraft:granite', 'minecraft:diorite', 'minecraft:andesite', 'minecraft:cobblestone',
+    'minecraft:coal_ore', 'minecraft:iron_ore', 'minecraft:gold_ore', 'minecraft:diamond_ore',
+    'minecraft:bedrock', 'minecraft:clay', 'minecraft:glass'
+] + [
+    f'minecraft:{color}_{kind}' for kind in ['wool', 'concrete', 'terracotta', 'stained_glass'] for color in colors
+]
+"""Blocks without properties, which palettes of generated chunks are drawn from, air first"""
+
+entityIDs = ['minecraft:pig', 'minecraft:cow', 'minecraft:sheep', 'minecraft:zombie', 'minecraft:item']
+"""Entities generated chunks are filled with"""
+
+sectionTemplates = 8
+"""Number of different block arrays generated per palette size, reused across sections"""
+
+templateCache = {}
+"""Result of section_templates for each palette size"""
+
+tileEntityIDs = ['minecraft:chest', 'minecraft:furnace', 'minecraft:hopper']
+"""Tile entities generated chunks are filled with, all with an inventory"""
+
+@contextlib.contextmanager
+def appdata(folder : str):
+    """Make World.from_saves find worlds in <folder>/.minecraft/saves during the with block"""
+    previous = os.environ.get('appdata')
+    os.environ['appdata'] = folder
+    
+    try:
+        yield os.path.join(folder, '.minecraft', 'saves')
+    
+    finally:
+        if previous is None:
+            del os.environ['appdata']
+        else:
+            os.environ['appdata'] = previous
+
+def best_time(function, repeat : int = 3, setup = None):
+    """Return the shortest duration in seconds of <repeat> calls to function()
+    
+    <setup> : Called without arguments before each call, and not timed
+    """
+    times = []
+    
+    for _ in range(repeat):
+        
+        if setup is not None:
+            setup()
+        
+        startTime = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - startTime)
+    
+    return min(times)
+
+def compare(results : dict, baseline : dict, tolerance : float = 0.1):
+    """Return the ratio of the duration of every benchmark in <results> to the one in <baseline>
+    
+    Log a warning for every benchmark more than <tolerance> slower than <baseline>
+    """
+    ratios = {}
+    
+    for name, benchmark in results['benchmarks'].items():
+        
+        if name not in baseline['benchmarks']:
+            continue
+        
+        ratios[name] = benchmark['seconds'] / max(baseline['benchmarks'][name]['seconds'], 1e-9)
+        
+        if ratios[name] > 1 + tolerance:
+            logging.warning(f'{name} is {ratios[name]:.2f}x as slow as baseline')
+    
+    return ratios
+
+def generate_chunk(
+    x : int,
+    z : int,
+    rng : random.Random,
+    sections : int = 4,
+    entities : int = 4,
+    tileEntities : int = 2,
+    paletteSize : int = 16
+):
+    """Return a Chunk at chunk coords <x> <z>, with random contents drawn from <rng>
+    
+    <sections> : Number of 16-block-high sections filled with blocks from the bottom
+    <entities>, <tileEntities> : Number of each in the chunk
+    <paletteSize> : Number of different blocks in each section
+    """
+    if paletteSize not in range(1, len(blockNames) + 1):
+        raise ValueError(f'Palette size must be 1-{len(blockNames)}, not {paletteSize}')
+    
+    def random_pos():
+        """Return random block coords inside of this chunk"""
+        return x * 16 + rng.randrange(16), rng.randrange(sections * 16 or 256), z * 16 + rng.randrange(16)
+    
+    def random_uuid():
+        """Return a random UUID, as stored by 1.16 worlds"""
+        return TAG.Int_Array([TAG.Int(rng.randrange(-2**31, 2**31)) for _ in range(4)])
+    
+    level = {
+        'xPos' : TAG.Int(x),
+        'zPos' : TAG.Int(z),
+        'Status' : TAG.String('full'),
+        'Sections' : TAG.List([]),
+        'Entities' : TAG.List([]),
+        'TileEntities' : TAG.List([]),
+        'TileTicks' : TAG.List([])
+    }
+    
+    for y in range(sections):
+        palette = [blockNames[0]] + rng.sample(blockNames[1:], paletteSize - 1)
+        level['Sections'].append(TAG.Compound({
+            'Y' : TAG.Byte(y),
+            'Palette' : TAG.List([TAG.Compound({'Name' : TAG.String(name)}) for name in palette]),
+            'BlockStates' : TAG.Long_Array([TAG.Long(i) for i in rng.choice(section_templates(paletteSize))])
+        }))
+    
+    for _ in range(entities):
+        xPos, yPos, zPos = random_pos()
+        level['Entities'].append(TAG.Compound({
+            'id' : TAG.String(rng.choice(entityIDs)),
+            'Pos' : TAG.List([TAG.Double(xPos + 0.5), TAG.Double(yPos), TAG.Double(zPos + 0.5)]),
+            'Motion' : TAG.List([TAG.Double(0), TAG.Double(0), TAG.Double(0)]),
+            'Rotation' : TAG.List([TAG.Float(rng.uniform(0, 360)), TAG.Float(0)]),
+            'Health' : TAG.Float(10),
+            'UUID' : random_uuid()
+        }))
+    
+    for _ in range(tileEntities):
+        xPos, yPos, zPos = random_pos()
+        level['TileEntities'].append(TAG.Compound({
+            'id' : TAG.String(rng.choice(tileEntityIDs)),
+            'x' : TAG.Int(xPos),
+            'y' : TAG.Int(yPos),
+            'z' : TAG.Int(zPos),
+            'Items' : TAG.List([
+                TAG.Compound({
+                    'Slot' : TAG.Byte(slot),
+                    'id' : TAG.String(rng.choice(blockNames[1:])),
+                    'Count' : TAG.Byte(rng.randrange(1, 65))
+                })
+                for slot in range(rng.randrange(5))
+            ])
+        }))
+        
+        xPos, yPos, zPos = random_pos()
+        level['TileTicks'].append(TAG.Compound({
+            'i' : TAG.String('minecraft:water'),
+            'x' : TAG.Int(xPos),
+            'y' : TAG.Int(yPos),
+            'z' : TAG.Int(zPos),
+            't' : TAG.Int(rng.randrange(20)),
+            'p' : TAG.Int(0)
+        }))
+    
+    return Chunk(TAG.Compound({
+        '' : TAG.Compound({
+            'DataVersion' : TAG.Int(2578),
+            'Level' : TAG.Compound(level)
+        })
+    }))
+
+def generate_world(
+    folder : str,
+    regions : int = 4,
+    density : float = 0.25,
+    sections : int = 4,
+    entities : int = 4,
+    tileEntities : int = 2,
+    paletteSize : int = 16,
+    maps : int = 16,
+    players : int = 4,
+    seed : int = 0
+):
+    """Generate a world at <folder>, same parameters and seed giving the same world
+    
+    <regions> : Number of overworld regions, in a square around the origin.
+                The nether has one region for every 8 of them, as it is 8 times smaller.
+    <density> : Fraction of chunks of each region which exist
+    <maps>, <players> : Number of each in the world
+    Other arguments are passed to generate_chunk
+    """
+    if not 0 < density <= 1:
+        raise ValueError(f'Density must be more than 0 and at most 1, not {density}')
+    
+    rng = random.Random(seed)
+    side = math.ceil(math.sqrt(regions))
+    keys = [(i % side - side // 2, i // side - side // 2) for i in range(regions)]
+    
+    for subfolder, dimensionKeys in [
+        ('region', keys),
+        (os.path.join('DIM-1', 'region'), keys[:math.ceil(regions / 8)])
+    ]:
+        os.makedirs(os.path.join(folder, subfolder), exist_ok = True)
+        
+        for xRegion, zRegion in dimensionKeys:
+            
+            path = os.path.join(folder, subfolder, f'r.{xRegion}.{zRegion}.mca')
+            
+            with McaFile.open(path, protected = False) as f:
+                for key in sorted(rng.sample(range(McaFile.sideLength ** 2), round(density * McaFile.sideLength ** 2))):
+                    zChunk, xChunk = divmod(key, McaFile.sideLength)
+                    f[key] = generate_chunk(
+                        x = xRegion * McaFile.sideLength + xChunk,
+                        z = zRegion * McaFile.sideLength + zChunk,
+                        rng = rng,
+                        sections = sections,
+                        entities = entities,
+                        tileEntities = tileEntities,
+                        paletteSize = paletteSize
+                    )
+    
+    os.makedirs(os.path.join(folder, 'data'), exist_ok = True)
+    
+    for i in range(maps):
+        with DatFile(os.path.join(folder, 'data', f'map_{i}.dat')) as f:
+            f.value = TAG.Compound({
+                '' : TAG.Compound({
+                    'data' : TAG.Compound({
+                        'dimension' : TAG.String(rng.choice(['minecraft:overworld', 'minecraft:the_nether'])),
+                        'scale' : TAG.Byte(0),
+                        'xCenter' : TAG.Int(rng.randrange(-1024, 1024)),
+                        'zCenter' : TAG.Int(rng.randrange(-1024, 1024)),
+                        'colors' : TAG.Byte_Array([TAG.Byte(rng.randrange(128)) for _ in range(128 * 128)])
+                    }),
+                    'DataVersion' : TAG.Int(2578)
+                })
+            })
+    
+    if maps > 0:
+        with DatFile(os.path.join(folder, 'data', 'idcounts.dat')) as f:
+            f.value = TAG.Compound({
+                '' : TAG.Compound({
+                    'data' : TAG.Compound({'map' : TAG.Int(maps - 1)}),
+                    'DataVersion' : TAG.Int(2578)
+                })
+            })
+    
+    os.makedirs(os.path.join(folder, 'playerdata'), exist_ok = True)
+    
+    for i in range(players):
+        uuid = f'{rng.getrandbits(32):08x}-0000-4000-8000-{i:012x}'
+        with DatFile(os.path.join(folder, 'playerdata', f'{uuid}.dat')) as f:
+            f.value = TAG.Compound({
+                '' : TAG.Compound({
+                    'Dimension' : TAG.String(rng.choice(['minecraft:overworld', 'minecraft:the_nether'])),
+                    'Pos' : TAG.List([TAG.Double(rng.uniform(-256, 256)), TAG.Double(64), TAG.Double(rng.uniform(-256, 256))]),
+                    'DataVersion' : TAG.Int(2578)
+                })
+            })
+
+def run(
+    folder : str = None,
+    regions : int = 4,
+    density : float = 0.25,
+    sections : int = 4,
+    entities : int = 4,
+    tileEntities : int = 2,
+    paletteSize : int = 16,
+    samples : int = 64,
+    repeat : int = 3,
+    workers : int = None,
+    output : str = None,
+    baseline : str = None
+):
+    """Time key operations on generated worlds, return results as a dict
+    
+    <folder> : Where to generate worlds, defaults to a temporary folder removed afterwards
+    <samples> : Number of chunks timed by chunk-level benchmarks
+    <repeat> : Number of runs of each benchmark, of which the fastest is kept
+    <workers> : Passed to fuse
+    <output> : Path of a JSON file to write results to
+    <baseline> : Path of a JSON file written by an earlier run, to compare results against
+    Other arguments are passed to generate_world
+    
+    Results hold the parameters of this run and, for each benchmark,
+    its 'seconds', number of 'operations' and 'perSecond', plus 'baselineRatio' if <baseline> is given.
+    """
+    parameters = {
+        'regions' : regions,
+        'density' : density,
+        'sections' : sections,
+        'entities' : entities,
+        'tileEntities' : tileEntities,
+        'paletteSize' : paletteSize,
+        'samples' : samples,
+        'repeat' : repeat
+    }
+    
+    benchmarks = {}
+    
+    def record(name, operations, function, setup = None):
+        """Time function() and add it to <benchmarks> as <name>"""
+        seconds = best_time(function, repeat = repeat, setup = setup)
+        benchmarks[name] = {
+            'seconds' : seconds,
+            'operations' : operations,
+            'perSecond' : operations / max(seconds, 1e-9)
+        }
+        logging.info(f'{name:>14} : {seconds:9.4f}s, {benchmarks[name]["perSecond"]:12,.1f} per second')
+    
+    with contextlib.ExitStack() as stack:
+        
+        if folder is None:
+            folder = stack.enter_context(tempfile.TemporaryDirectory())
+        
+        saves = stack.enter_context(appdata(folder))
+        
+        logging.info(f'Generating worlds in {saves}...')
+        for name, seed in [('destination', 0), ('source', 1)]:
+            shutil.rmtree(os.path.join(saves, name), ignore_errors = True)
+            generate_world(
+                os.path.join(saves, name),
+                seed = seed,
+                **{key : value for key, value in parameters.items() if key not in ['samples', 'repeat']}
+            )
+        
+        source = World.from_saves('source')
+        overworld = source.dimensions['minecraft:overworld']
+        regionPaths = [overworld.region_path(key) for key in overworld.regions()]
+        
+        datas = []
+        # Compressed (data, compression) of sampled chunks
+        with McaFile.open(regionPaths[0]) as f:
+            for key in range(McaFile.sideLength ** 2):
+                if len(datas) < samples and key in f:
+                    datas.append(f.load_data(key))
+        
+        raws = [decompress(*data)[0] for data in datas]
+        chunks = [Chunk.from_bytes(raw) for raw in raws]
+        
+        logging.info('Running benchmarks...')
+        
+        record('nbt_decode', len(raws), lambda : [Chunk.from_bytes(raw) for raw in raws])
+        record('nbt_encode', len(chunks), lambda : [chunk.to_bytes() for chunk in chunks])
+        
+        coords = [(x, 0, z) for z in range(16) for x in range(16)]
+        # Bottom layer of blocks, as each block is slow to get and set
+        
+        def get_blocks():
+            for chunk in chunks:
+                for key in coords:
+                    chunk[key]
+        
+        def set_blocks():
+            for chunk in chunks:
+                block = chunk[0, 0, 0]
+                for key in coords:
+                    chunk[key] = block
+                chunk.save_all()
+        
+        record('block_get', len(chunks) * len(coords), get_blocks, setup = lambda : [chunk.discard_all() for chunk in chunks])
+        record('block_set', len(chunks) * len(coords), set_blocks, setup = lambda : [chunk.discard_all() for chunk in chunks])
+        
+        copyFolder = os.path.join(folder, 'copies')
+        os.makedirs(copyFolder, exist_ok = True)
+        
+        def write_regions():
+            for path in regionPaths:
+                f = McaFile.open(path)
+                f.path = os.path.join(copyFolder, os.path.basename(path))
+                f.write(incremental = False)
+        
+        record('region_read', len(regionPaths), lambda : [McaFile.open(path) for path in regionPaths])
+        record('region_write', len(regionPaths), write_regions)
+        
+        def clear_occupancy():
+            """Forget occupancy and pyramids of every world, as if they were never mapped"""
+            Dimension.pyramids.clear()
+            for name in ['destination', 'source']:
+                for dimension in World.from_saves(name).dimensions.values():
+                    with contextlib.suppress(OSError):
+                        os.remove(os.path.join(dimension.folder, Dimension.occupancyFileName))
+        
+        destination = World.from_saves('destination')
+        
+        record('binary_map', len(regionPaths), overworld.binary_map, setup = clear_occupancy)
+        record('offset_search', 1, lambda : find_offsets(destination, source), setup = clear_occupancy)
+        
+        chunkTotal = sum([
+            len(McaFile.open(dimension.region_path(key)))
+            for name in ['minecraft:overworld', 'minecraft:the_nether']
+            for dimension in [source.dimensions[name]]
+            for key in dimension.regions()
+        ])
+        
+        def copy_worlds():
+            for name in ['destination', 'source']:
+                shutil.rmtree(os.path.join(saves, f'fuse_{name}'), ignore_errors = True)
+                shutil.copytree(os.path.join(saves, name), os.path.join(saves, f'fuse_{name}'))
+            clear_occupancy()
+        
+        record('fuse', chunkTotal, lambda : fuse('fuse_destination', 'fuse_source', workers = workers), setup = copy_worlds)
+    
+    results = {
+        'parameters' : parameters,
+        'python' : platform.python_version(),
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks' : benchmarks
+    }
+    
+    if baseline is not None:
+        with open(baseline, mode = 'r') as f:
+            ratios = compare(results, json.load(f))
+        for name, ratio in ratios.items():
+            benchmarks[name]['baselineRatio'] = ratio
+    
+    if output is not None:
+        with util.atomic_write(output, mode = 'w') as f:
+            json.dump(results, f, indent = 4)
+    
+    return results
+
+def section_templates(paletteSize : int):
+    """Return a list of <sectionTemplates> random block arrays of sections with <paletteSize> blocks
+    
+    Each is a list of the signed 64-bit ints of a BlockStates array, as packed by Chunk.
+    Sections of generated chunks share them, as drawing 4096 blocks per section is slow.
+    Always the same for the same <paletteSize>.
+    """
+    if paletteSize not in templateCache:
+        
+        rng = random.Random(paletteSize)
+        blockLen = max(4, (paletteSize - 1).bit_length())
+        blocksPerUnit = 64 // blockLen
+        templates = []
+        
+        for _ in range(sectionTemplates):
+            
+            blocks = rng.choices(range(paletteSize), k = 4096)
+            units = []
+            
+            for start in range(0, 4096, blocksPerUnit):
+                unit = 0
+                for i, block in enumerate(blocks[start : start + blocksPerUnit]):
+                    unit |= block << (i * blockLen)
+                units.append(unit - (1 << 64) if unit >= 1 << 63 else unit)
+            
+            templates.append(units)
+        
+        templateCache[paletteSize] = templates
+    
+    return templateCache[paletteSize]
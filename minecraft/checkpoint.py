@@ -0,0 +1,66 @@
+import json
+import os
+import util
+
+class Checkpoint():
+    """Progress of a fusion, kept on disk so that an interrupted fusion can resume where it stopped
+    
+    Stored as JSON in the destination world's folder, and replaced atomically at every save
+    """
+    
+    __slots__ = ['path', 'value']
+    
+    fileName = 'infinifuse_checkpoint.json'
+    """Name of checkpoint files inside world folders"""
+    
+    def __init__(self, path : str, value : dict = None):
+        
+        self.path = path
+        """Path of file for IO"""
+        
+        self.value = value or {}
+        """dict containing this checkpoint's data"""
+    
+    def __contains__(self, key):
+        return key in self.value
+    
+    def __getitem__(self, key):
+        return self.value[key]
+    
+    def __repr__(self):
+        return f'Checkpoint at {self.path}'
+    
+    def __setitem__(self, key, value):
+        self.value[key] = value
+    
+    def delete(self):
+        """Forget all progress and remove the checkpoint file"""
+        self.value = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def done_regions(self, dimension : str):
+        """Return the set of region coords of <dimension> which were fully transferred"""
+        regions = self.value.get('regions', {}).get(dimension, [])
+        return set([tuple(i) for i in regions])
+    
+    def mark_done(self, dimension : str, regions):
+        """Record <regions> of <dimension> as fully transferred. Call save() to make it durable"""
+        done = self.value.setdefault('regions', {}).setdefault(dimension, [])
+        done.extend([list(i) for i in regions])
+    
+    @classmethod
+    def open(cls, folder : str):
+        """Open the checkpoint file of world in <folder>, or an empty checkpoint if there is none"""
+        path = os.path.join(folder, cls.fileName)
+        
+        if os.path.exists(path):
+            with open(path, mode = 'r') as f:
+                return cls(path = path, value = json.load(f))
+        else:
+            return cls(path = path)
+    
+    def save(self):
+        """Write this checkpoint to disk"""
+        with util.atomic_write(self.path, mode = 'w') as f:
+            json.dump(self.value, f)
\ No newline at end of file
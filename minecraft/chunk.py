@@ -15,7 +15,7 @@ class Chunk(TAG.MutableMapping, util.Cache):
     
     def __init__(self, value : dict = None):
 
-        self._cache = {}
+        util.Cache.__init__(self)
         """Contains dynamically loaded blocks"""
 
         self.value = value or {}
@@ -105,6 +105,15 @@ class Chunk(TAG.MutableMapping, util.Cache):
         sectionID, blockID = divmod(y*16*16 + z*16 + x, 4096)
         return sectionID, blockID
 
+    def is_dirty(self, key, value):
+        """Whether cached block <value> was changed since it was loaded"""
+        return value.modified
+    
+    def iter_encode(self):
+        """Generate NBT data in blocks. Will save all cached changes"""
+        self.save_all()
+        return super().iter_encode()
+    
     def load_value(self, key):
         """Read BlockState at coords in <key>"""
         sectionID, blockID = self.find_section(key)
@@ -126,12 +135,29 @@ class Chunk(TAG.MutableMapping, util.Cache):
                     block = BlockState(section['Palette'][paletteID])
                 break
         
+        block.mark_clean()
         return block
+    
+    def mark_clean(self):
+        """Mark NBT data and cached blocks as unchanged"""
+        super().mark_clean()
+        for block in self._cache.values():
+            block.mark_clean()
+    
+    @property
+    def modified(self):
+        """Whether NBT data or any cached block changed since this chunk was loaded or saved"""
+        return super().modified or any(self.needs_save(key, value) for key, value in self._cache.items())
 
     def to_bytes(self):
         """Return NBT data as a bytearray. Will save all cached changes"""
         self.save_all()
-        return super().to_bytes()
+        
+        with util.metrics.span('chunk_encode_seconds'):
+            data = super().to_bytes()
+        
+        util.metrics.observe('chunk_encoded_bytes', len(data), util.Metrics.sizeBuckets)
+        return data
 
     def save_value(self, key, value):
         """Save block <value> at <key> from cache to self.value"""
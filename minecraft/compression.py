@@ -1,38 +1,308 @@
 import gzip
+import lzma
+import time
+import util
 import zlib
 
-def compress(data, compression : int = 3):
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+class Codec():
+    """A compression method, identified by the compression ID stored before each chunk in region files"""
+    
+    __slots__ = ['ID', 'compressor', 'decompressor', 'magic', 'name']
+    
+    def __init__(self, ID : int, name : str, compressor, decompressor, magic : bytes = None):
+        
+        self.ID = ID
+        """Compression ID of this codec"""
+        
+        self.name = name
+        """Human-readable name of this codec"""
+        
+        self.compressor = compressor
+        """Function(data, level) returning compressed data, <level> being None for the default level"""
+        
+        self.decompressor = decompressor
+        """Function(data) returning decompressed data"""
+        
+        self.magic = magic
+        """Bytes every output of this codec starts with, or None if there are none"""
+    
+    def __repr__(self):
+        return f'Codec {self.ID} ({self.name})'
+    
+    def compress(self, data, level : int = None):
+        """Return compressed <data>"""
+        startTime = time.perf_counter()
+        compressed = self.compressor(data, level)
+        self.record('compress', time.perf_counter() - startTime, len(data), len(compressed))
+        return compressed
+    
+    def decompress(self, data):
+        """Return decompressed <data>"""
+        startTime = time.perf_counter()
+        decompressed = self.decompressor(data)
+        self.record('decompress', time.perf_counter() - startTime, len(data), len(decompressed))
+        return decompressed
+    
+    def iter_compress(self, blocks, level : int = None):
+        """Generate compressed data from an iterable of bytes-like <blocks>
+        
+        Codecs which cannot stream compress all blocks at once
+        """
+        yield self.compress(b''.join(blocks), level)
+    
+    def iter_decompress(self, blocks):
+        """Generate decompressed data from an iterable of compressed bytes-like <blocks>
+        
+        Codecs which cannot stream decompress all blocks at once
+        """
+        yield self.decompress(b''.join(blocks))
+    
+    def matches(self, data):
+        """Whether <data> looks like it was compressed with this codec"""
+        return self.magic is not None and bytes(data[:len(self.magic)]) == self.magic
+    
+    def record(self, operation : str, seconds : float, inputBytes : int, outputBytes : int):
+        """Add one <operation>, 'compress' or 'decompress', to util.metrics"""
+        util.metrics.observe(f'{operation}_seconds', seconds, codec = self.name)
+        util.metrics.count(f'{operation}_input_bytes_total', inputBytes, codec = self.name)
+        util.metrics.count(f'{operation}_output_bytes_total', outputBytes, codec = self.name)
+
+class Uncompressed(Codec):
+    """Data stored as-is, which streams block by block"""
+    
+    __slots__ = []
+    
+    def iter_compress(self, blocks, level : int = None):
+        yield from blocks
+    
+    def iter_decompress(self, blocks):
+        yield from blocks
+
+class ZlibCodec(Codec):
+    """Deflate-based codecs, which stream through zlib compress and decompress objects
+    
+    Streams without magic bytes are recognized by their checksummed 2-byte zlib header
+    """
+    
+    __slots__ = ['wbits']
+    
+    def __init__(self, wbits : int, **kwargs):
+        
+        super().__init__(**kwargs)
+        
+        self.wbits = wbits
+        """Window size and container format, as understood by zlib"""
+    
+    def iter_compress(self, blocks, level : int = None):
+        """Generate compressed data, recorded as a single operation once the stream ends, see record
+        
+        Only time spent compressing is counted, not time spent by callers between blocks
+        """
+        compressor = zlib.compressobj(-1 if level is None else level, zlib.DEFLATED, self.wbits)
+        seconds = 0
+        inputBytes = 0
+        outputBytes = 0
+        
+        try:
+            for block in blocks:
+                startTime = time.perf_counter()
+                data = compressor.compress(block)
+                seconds += time.perf_counter() - startTime
+                inputBytes += len(block)
+                outputBytes += len(data)
+                if data:
+                    yield data
+            
+            data = compressor.flush()
+            outputBytes += len(data)
+            yield data
+        
+        finally:
+            self.record('compress', seconds, inputBytes, outputBytes)
+    
+    def iter_decompress(self, blocks):
+        """Generate decompressed data by pieces of at most <blockSize> bytes, or so
+        
+        Recorded like iter_compress, even if callers stop reading before the end
+        """
+        decompressor = zlib.decompressobj(self.wbits)
+        seconds = 0
+        inputBytes = 0
+        outputBytes = 0
+        
+        try:
+            for block in blocks:
+                inputBytes += len(block)
+                while block:
+                    startTime = time.perf_counter()
+                    data = decompressor.decompress(block, blockSize)
+                    seconds += time.perf_counter() - startTime
+                    outputBytes += len(data)
+                    yield data
+                    block = decompressor.unconsumed_tail
+            
+            data = decompressor.flush()
+            outputBytes += len(data)
+            yield data
+        
+        finally:
+            self.record('decompress', seconds, inputBytes, outputBytes)
+    
+    def matches(self, data):
+        
+        if self.magic is not None:
+            return super().matches(data)
+        
+        return (
+                len(data) >= 2
+            and data[0] & 0x0F == 8
+            and int.from_bytes(data[:2], 'big') % 31 == 0
+        )
+
+blockSize = 65536
+"""Size in bytes of the pieces streams are read and decompressed by"""
+
+codecs = {}
+"""Registered codecs by compression ID"""
+
+levels = {
+    'default' : None,
+    'fast'    : 1,
+    'small'   : 9
+}
+"""Compression level of each mode. None uses the default level of each compression method
+fast   : For intermediate or scratch worlds
+small  : For archival output
+"""
+
+uncompressed = 3
+"""Compression ID of data which matches no codec"""
+
+def compare_levels(datas, compression : int = 2):
+    """Compress every bytes-like object in <datas> with each mode of <levels>
+    
+    Return a dict of {'size', 'ratio', 'throughput'} for each mode,
+    throughput being in uncompressed bytes per second
+    """
+    datas = list(datas)
+    rawSize = sum([len(data) for data in datas])
+    report = {}
+    
+    for mode, level in levels.items():
+        
+        startTime = time.perf_counter()
+        size = sum([len(compress(data, compression, level)) for data in datas])
+        elapsedTime = time.perf_counter() - startTime
+        
+        report[mode] = {
+            'size' : size,
+            'ratio' : size / max(rawSize, 1),
+            'throughput' : rawSize / max(elapsedTime, 1e-9)
+        }
+    
+    return report
+
+def compress(data, compression : int = 3, level : int = None):
     """Compress a bytes-like object, return (data)
     
-    Uses the compression methods specified by minecraft
+    <compression> : ID of a registered codec. 1 gzip, 2 zlib and 3 none are the ones specified by minecraft
+    <level> : 0-9 compression level, or None for the default level of <compression>
     """
-    if compression == 1:
-        return gzip.compress(data)
-    elif compression == 2:
-        return zlib.compress(data)
-    elif compression == 3:
-        return data
-    else:
-        raise ValueError(f'Unknown compression method {compression}')
+    return get_codec(compression).compress(data, level)
 
 def decompress(data, compression : int = None):
     """Decompress a bytes-like object, return (data, compression)
     
-    Uses the compression methods specified by minecraft
+    If <compression> is None, it is found from the first bytes of <data>
     """
     if compression is None:
-        for tryCompression in [1,2,3]:
-            try:
-                return decompress(data, tryCompression)
-            except (gzip.BadGzipFile, zlib.error):
-                continue
-        raise RuntimeError('Unknown compression method.')
-    elif compression == 1:
-        data = gzip.decompress(data)
-    elif compression == 2:
-        data = zlib.decompress(data)
-    elif compression == 3:
-        data = data
-    else:
+        compression = detect(data)
+    
+    return get_codec(compression).decompress(data), compression
+
+def iter_compress(blocks, compression : int = 3, level : int = None):
+    """Generate compressed data from an iterable of bytes-like <blocks>, see compress"""
+    return get_codec(compression).iter_compress(blocks, level)
+
+def iter_decompress(blocks, compression : int):
+    """Generate decompressed data from an iterable of compressed bytes-like <blocks>
+    
+    Unlike decompress, <compression> cannot be guessed, use detect on the first block
+    """
+    return get_codec(compression).iter_decompress(blocks)
+
+def detect(data):
+    """Return ID of the codec <data> was compressed with, judging by its first bytes"""
+    for codec in codecs.values():
+        if codec.matches(data):
+            return codec.ID
+    return uncompressed
+
+def get_codec(compression : int):
+    """Return registered codec with ID <compression>"""
+    try:
+        return codecs[compression]
+    except KeyError:
         raise ValueError(f'Unknown compression method {compression}')
-    return data, compression
\ No newline at end of file
+
+def register(codec : Codec):
+    """Make <codec> usable by compress and decompress
+    
+    Minecraft uses IDs 1 to 4, and 127 for its own custom codecs.
+    Region files have room for IDs up to 127, higher ones flag chunks stored in separate files.
+    """
+    if codec.ID not in range(1, 128):
+        raise ValueError(f'Compression ID must be 1-127, not {codec.ID}')
+    
+    if codec.ID in codecs:
+        raise ValueError(f'Compression ID {codec.ID} is already used by {codecs[codec.ID]}')
+    
+    codecs[codec.ID] = codec
+
+register(ZlibCodec(
+    ID = 1,
+    name = 'gzip',
+    compressor = lambda data, level : gzip.compress(data) if level is None else gzip.compress(data, level),
+    decompressor = gzip.decompress,
+    magic = b'\x1f\x8b',
+    wbits = 16 + zlib.MAX_WBITS
+))
+
+register(ZlibCodec(
+    ID = 2,
+    name = 'zlib',
+    compressor = lambda data, level : zlib.compress(data) if level is None else zlib.compress(data, level),
+    decompressor = zlib.decompress,
+    wbits = zlib.MAX_WBITS
+))
+
+register(Uncompressed(
+    ID = 3,
+    name = 'none',
+    compressor = lambda data, level : data,
+    decompressor = lambda data : data
+))
+
+# Custom codecs, which minecraft itself cannot read. Meant for scratch worlds and caches
+register(Codec(
+    ID = 100,
+    name = 'lzma',
+    compressor = lambda data, level : lzma.compress(data, preset = level),
+    decompressor = lzma.decompress,
+    magic = b'\xfd7zXZ\x00'
+))
+
+if lz4 is not None:
+    # LZ4 frames, which differ from the LZ4Block streams minecraft uses for ID 4
+    register(Codec(
+        ID = 101,
+        name = 'lz4',
+        compressor = lambda data, level : lz4.frame.compress(data, compression_level = level or 0),
+        decompressor = lz4.frame.decompress,
+        magic = b'\x04\x22\x4d\x18'
+    ))
\ No newline at end of file
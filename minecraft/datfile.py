@@ -1,6 +1,9 @@
-from minecraft.compression import compress, decompress
+from minecraft.compression import blockSize, detect, iter_compress, iter_decompress
+import functools
+import itertools
 import minecraft.TAG as TAG
 import os
+import util
 
 class DatFile(TAG.MutableMapping):
     """Interface for .dat files
@@ -19,9 +22,17 @@ class DatFile(TAG.MutableMapping):
     
         if os.path.exists(self.path):
         
-            with open(self.path, mode = 'rb') as f:
-                data, compression = decompress(f.read())
-            self.value = super().decode(data)
+            # Decompressed and decoded as it is read, so the whole file is never in memory at once
+            with util.metrics.span('dat_read_seconds'), open(self.path, mode = 'rb') as f:
+                
+                blocks = iter(functools.partial(f.read, blockSize), b'')
+                firstBlock = next(blocks, b'')
+                compression = detect(firstBlock)
+                
+                data = iter_decompress(itertools.chain([firstBlock], blocks), compression)
+                self.value = super().decode(itertools.chain.from_iterable(data))
+                
+                util.metrics.count('dat_read_bytes_total', f.tell())
             
         else:
         
@@ -29,13 +40,23 @@ class DatFile(TAG.MutableMapping):
             self.value = {}
         
         self.compression = self.compression or compression
+        self.mark_clean()
         
         return self
 
     def __exit__(self, exc_type = None, exc_value = None, traceback = None):
-        """Save value to disk"""
-        with open(self.path, mode = 'wb') as f:
-            f.write(compress(data = self.to_bytes(), compression = self.compression))
+        """Save value to disk if it changed"""
+        
+        if not self.modified:
+            return
+        
+        size = 0
+        with util.metrics.span('dat_write_seconds'), util.atomic_write(self.path) as f:
+            for data in iter_compress(self.iter_encode(), compression = self.compression):
+                f.write(data)
+                size += len(data)
+        
+        util.metrics.count('dat_write_bytes_total', size)
 
     def __repr__(self):
         return f'DatFile at {self.path}'
\ No newline at end of file
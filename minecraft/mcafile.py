@@ -1,7 +1,7 @@
 from .chunk import Chunk
-from .compression import compress, decompress
+from .compression import compress, iter_compress, iter_decompress
 import collections.abc
-import concurrent.futures
+import itertools
 import math
 import os
 import time
@@ -10,14 +10,35 @@ import util
 class McaFile(collections.abc.Sequence, util.Cache):
     """Interface for .mca files"""
     
-    __slots__ = ['_cache', '_path', 'protected', 'value']
+    __slots__ = ['_cache', '_changes', '_path', 'compression', 'executor', 'level', 'protected', 'value']
+    
+    compressors = util.Executor(kind = 'thread')
+    """Threads compressing chunks when saving, zlib releases the GIL so they run in parallel"""
+    
     sectorLength = 4096
     sideLength = 32
     
-    def __init__(self, path : str = None, protected : bool = True, value : bytearray = None):
+    def __init__(self, 
+        path : str = None, 
+        protected : bool = True, 
+        value : bytearray = None, 
+        executor : util.Executor = None,
+        maxSize : int = None,
+        level : int = None,
+        compression : int = 2
+    ):
+        
+        util.Cache.__init__(self, maxSize = maxSize)
+        """Cache containing loaded chunks, holding at most <maxSize> of them"""
+        
+        self.executor = executor or util.Executor.default()
+        """Executor used to decode chunks in parallel"""
         
-        self._cache = {}
-        """Cache containing loaded chunks"""
+        self.compression = compression
+        """ID of the codec used to compress saved chunks, see compression.codecs"""
+        
+        self.level = level
+        """Level used to compress saved chunks, see compression.levels"""
         
         self.path = path
         """Path of file for IO"""
@@ -27,6 +48,9 @@ class McaFile(collections.abc.Sequence, util.Cache):
         
         self.value = value
         """bytearray containing this file's data"""
+        
+        self._changes = [] if value is None else [(0, len(value))]
+        """(start, end) byte ranges of self.value changed since it was last read or written"""
     
     def __contains__(self, key):
         """Whether chunk <key> contains any data"""
@@ -44,9 +68,22 @@ class McaFile(collections.abc.Sequence, util.Cache):
         return util.Cache.__getitem__(self, key)
     
     def __iter__(self):
-        with concurrent.futures.ProcessPoolExecutor() as e:
-            for chunk in e.map(self.load_value, range(self.maxLength)):
-                yield chunk
+        """Generate every chunk of this file in key order, or None where a chunk does not exist
+        
+        Only the compressed data of each chunk is sent to self.executor
+        """
+        datas = [self.load_data(key) for key in range(self.maxLength)]
+        existing = [data for data in datas if data is not None]
+        
+        chunks = self.executor.map(
+            self.decode_chunk, 
+            [data for data, _ in existing], 
+            [compression for _, compression in existing],
+            chunksize = 32
+        )
+        
+        for data in datas:
+            yield None if data is None else next(chunks)
     
     def __len__(self):
         """Total number of chunks that actually exist inside this file"""
@@ -114,6 +151,16 @@ class McaFile(collections.abc.Sequence, util.Cache):
         _, regionX, regionZ, _ = os.path.basename(self.path).split('.')
         return (int(regionX), int(regionZ))
 
+    @staticmethod
+    def decode_chunk(data, compression : int):
+        """Return a Chunk from its compressed <data>, decoded as it is decompressed"""
+        with util.metrics.span('chunk_decode_seconds'):
+            chunk = Chunk.from_bytes(itertools.chain.from_iterable(iter_decompress([data], compression)))
+        
+        util.metrics.observe('chunk_compressed_bytes', len(data), util.Metrics.sizeBuckets)
+        chunk.mark_clean()
+        return chunk
+
     @classmethod
     def find_chunk(cls, folder : str, x : int, z : int):
         """Return containing file and key of chunk at <x> <z>"""
@@ -143,8 +190,12 @@ class McaFile(collections.abc.Sequence, util.Cache):
         else:
             return {'offset' : offset, 'sectorCount' : sectorCount, 'timestamp' : timestamp}
 
-    def load_value(self, key):
-        """Return data for chunk <key>"""
+    def is_dirty(self, key, value):
+        """Whether cached chunk <value> changed since it was loaded"""
+        return value.modified
+    
+    def load_data(self, key):
+        """Return (data, compression) of chunk <key> as stored in this file, or None if it does not exist"""
         header = self.get_header(key)
         
         if header is None:
@@ -153,21 +204,53 @@ class McaFile(collections.abc.Sequence, util.Cache):
         offset = header['offset'] * self.sectorLength
         length = int.from_bytes(self.value[offset : offset + 4], 'big')
         compression = self.value[offset + 4]
-        data = self.value[offset + 5 : offset + length + 4]
+        data = bytes(self.value[offset + 5 : offset + length + 4])
         
-        return Chunk.from_bytes(decompress(data, compression)[0])
+        return data, compression
+
+    def load_value(self, key):
+        """Return data for chunk <key>"""
+        data = self.load_data(key)
+        
+        if data is None:
+            return None
+        
+        return self.decode_chunk(*data)
 
     @property
     def maxLength(self):
         """Maximum chunk capacity of this file"""
         return self.sideLength ** 2
 
+    @property
+    def modified(self):
+        """Whether this file has changes that are not written to disk yet"""
+        return bool(self._changes) or any(self.needs_save(key, value) for key, value in self._cache.items())
+    
     @classmethod
-    def open(cls, path : str, protected : bool = True):
-        """Open from direct file path"""
-        f = cls(path = path, protected = protected)
+    def open(cls, 
+        path : str, 
+        protected : bool = True, 
+        executor : util.Executor = None,
+        level : int = None,
+        compression : int = 2,
+        maxSize : int = None
+    ):
+        """Open from direct file path, caching at most <maxSize> loaded chunks"""
+        f = cls(
+            path = path, 
+            protected = protected, 
+            executor = executor, 
+            level = level, 
+            compression = compression,
+            maxSize = maxSize
+        )
         f.read()
         return f
+    
+    def mark_changed(self, start : int, end : int):
+        """Remember that bytes [<start>:<end>] of self.value have to be written"""
+        self._changes.append((start, end))
 
     @property
     def path(self):
@@ -179,35 +262,60 @@ class McaFile(collections.abc.Sequence, util.Cache):
 
     @path.setter
     def path(self, value):
+        
+        if getattr(self, '_path', None) not in (None, value) and getattr(self, 'value', None) is not None:
+            # Data read from elsewhere must be written in full
+            self.mark_changed(0, len(self.value))
+        
         self._path = value
 
     def read(self):
-        """Load data from file as self.path to self.value"""
+        """Load data from file as self.path to self.value
+        
+        Roll back any write to this file that was interrupted
+        """
+        util.Journal(self.path).rollback()
+        
         if os.path.exists(self.path):
-            with open(self.path, mode = 'rb') as f:
+            with util.metrics.span('region_read_seconds'), open(self.path, mode = 'rb') as f:
                 self.value = bytearray(f.read())
+            util.metrics.count('region_read_bytes_total', len(self.value))
         else:
             self.value = bytearray(self.sectorLength*2)
+        
+        self._changes = []
+    
+    @classmethod
+    def read_occupancy(cls, path : str):
+        """Return an int of which bit n is set if chunk n exists in file at <path>, see chunk_key
+        
+        Only reads the chunk location table at the start of the file
+        """
+        util.Journal(path).rollback()
+        
+        with open(path, mode = 'rb') as f:
+            header = f.read(cls.sectorLength)
+        
+        occupancy = 0
+        for key in range(min(cls.sideLength ** 2, len(header) // 4)):
+            offset = int.from_bytes(header[key*4 : key*4 + 3], byteorder = 'big')
+            sectorCount = header[key*4 + 3]
+            if offset >= 2 and sectorCount > 0:
+                occupancy |= 1 << key
+        
+        return occupancy
 
-    def save_value(self, key, value):
-        """Save <value> as data for entry <key>"""
+    def save_data(self, key, data, compression : int):
+        """Save already compressed <data> as chunk <key>"""
         
-        value = self.convert_value(value)
-        value.save_all()
+        key = self.convert_key(key)
         
         # Get header info
         header = self.get_header(key)
         
         if header is None:
-            # If this chunk didn't exist in this file, find smallest free offset to save it
-            
-            offsets = [0]
-            for i in range(self.maxLength):
-                header = self.get_header(i)
-                if header is not None:
-                    offsets.append(header['offset'] + header['sectorCount'])
-            
-            offset = max(2, *offsets)
+            # If this chunk didn't exist in this file, save it after the last sector
+            offset = max(2, math.ceil(len(self.value) / self.sectorLength))
             oldSectorCount = 0
             
         else:
@@ -216,18 +324,19 @@ class McaFile(collections.abc.Sequence, util.Cache):
         
         if self.protected:
             if oldSectorCount != 0:
-                raise IOError(f'Cannot overwrite chunks in protected mode !\n {self.path} {key} {value}')
+                raise IOError(f'Cannot overwrite chunks in protected mode !\n {self.path} {key}')
         
-        # Prepare data
-        compression = 2
-        data = compress(value.to_bytes(), compression)
         length = len(data) + 1
 
         # Check if chunk size changed
         newSectorCount = math.ceil((length + 4) / self.sectorLength)
         sectorChange = newSectorCount - oldSectorCount
         
-        if sectorChange > 0:
+        if sectorChange > 0 and (offset + oldSectorCount) * self.sectorLength >= len(self.value):
+            # Nothing follows this chunk, simply grow the file
+            self.value += bytearray((offset + newSectorCount) * self.sectorLength - len(self.value))
+        
+        elif sectorChange > 0:
             # Change offsets for following chunks
             for i in range(self.maxLength):
             
@@ -240,6 +349,7 @@ class McaFile(collections.abc.Sequence, util.Cache):
             # Move following chunks
             oldStart = (offset + oldSectorCount) * self.sectorLength
             self.value = self.value[:oldStart] + bytearray(sectorChange*self.sectorLength) + self.value[oldStart:]
+            self.mark_changed(oldStart, len(self.value))
             
         
         # Write header
@@ -256,6 +366,41 @@ class McaFile(collections.abc.Sequence, util.Cache):
         self.value[offset : offset + 4] = length.to_bytes(4, 'big')
         self.value[offset + 4] = compression
         self.value[offset + 5 : offset + length + 4] = data
+        
+        self.mark_changed(offset, offset + newSectorCount * self.sectorLength)
+    
+    def save_all(self):
+        """Save all changed chunks in cache, compressing them in parallel"""
+        
+        dirty = [(key, value) for key, value in self._cache.items() if self.needs_save(key, value)]
+        
+        for _, value in dirty:
+            value.save_all()
+        
+        datas = self.compressors.map(
+            compress,
+            (value.to_bytes() for _, value in dirty),
+            itertools.repeat(self.compression),
+            itertools.repeat(self.level),
+            chunksize = 8
+        )
+        
+        for (key, value), data in zip(dirty, datas):
+            self.save_data(key, data, self.compression)
+            value.mark_clean()
+        
+        self.discard_all()
+    
+    def save_value(self, key, value):
+        """Save <value> as data for entry <key>"""
+        
+        value = self.convert_value(value)
+        value.save_all()
+        
+        with util.metrics.span('chunk_save_seconds'):
+            data = b''.join(iter_compress(value.iter_encode(), self.compression, self.level))
+        self.save_data(key, data, self.compression)
+        value.mark_clean()
 
     def set_header(self, 
         key : int, 
@@ -272,12 +417,58 @@ class McaFile(collections.abc.Sequence, util.Cache):
         if sectorCount is not None:
             self.value[key*4 + 3] = sectorCount
         
+        if offset is not None or sectorCount is not None:
+            self.mark_changed(key*4, key*4 + 4)
+        
         if timestamp is not None:
             timestamp = timestamp.to_bytes(length = 4, byteorder = 'big')
             self.value[key*4 + self.sectorLength : key*4 + self.sectorLength + 4] = timestamp
+            self.mark_changed(key*4 + self.sectorLength, key*4 + self.sectorLength + 4)
 
-    def write(self):
-        """Save all changes from cache and write them to disk"""
+    def write(self, incremental : bool = True):
+        """Save all changes from cache and write them to disk, if there are any
+        
+        <incremental> : Only write changed sectors and header entries if the file already exists.
+                        Overwritten bytes are journaled first, and restored by read()
+                        if the write gets interrupted.
+                        Otherwise, a temporary file replaces the whole file once fully written.
+        """
         self.save_all()
-        with open(self.path, mode = 'wb') as f:
-            f.write(self.value)
\ No newline at end of file
+        
+        if self._changes == []:
+            return
+        
+        if incremental and os.path.exists(self.path):
+        
+            ranges = []
+            for start, end in sorted(self._changes):
+                if ranges != [] and start <= ranges[-1][1]:
+                    ranges[-1][1] = max(end, ranges[-1][1])
+                else:
+                    ranges.append([start, end])
+            
+            headerLength = 2 * self.sectorLength
+            ranges.sort(key = lambda i : i[0] < headerLength)
+            
+            journal = util.Journal(self.path)
+            
+            with util.metrics.span('region_write_seconds'), open(self.path, mode = 'r+b') as f:
+                
+                journal.begin(f, ranges)
+                
+                for start, end in ranges:
+                    f.seek(start)
+                    f.write(self.value[start:end])
+                
+                f.flush()
+                os.fsync(f.fileno())
+            
+            journal.commit()
+            util.metrics.count('region_write_bytes_total', sum([end - start for start, end in ranges]))
+        
+        else:
+            with util.metrics.span('region_write_seconds'), util.atomic_write(self.path) as f:
+                f.write(self.value)
+            util.metrics.count('region_write_bytes_total', len(self.value))
+        
+        self._changes = []
\ No newline at end of file
@@ -1,26 +1,260 @@
+from .checkpoint import Checkpoint
+from .chunk import Chunk
+from .compression import compress, get_codec, levels
 from .mcafile import McaFile
+from .relocation import Relocation
 from .world import World
 from .world.dimension import Dimension
-import concurrent.futures
 import itertools
 import logging
-import minecraft.TAG as TAG
 import os
-import random
-import struct
+import tempfile
 import time
+import tracemalloc
 import util
 
 datefmt = '%Y %b %d %H:%M:%S'
 
+offsetGridSize = 2**18
+"""Most offsets find_offsets computes overlaps for at once, each taking about a microsecond"""
+
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s | %(message)s',
     level=logging.INFO,
     datefmt=datefmt
 )
 
-def find_offsets(destination : World, source : World):
-    """Find offsets with no conflicts to fuse the Overworld and Nether of <destination> and <source>"""
+def estimate_fuse(
+    destination : str,
+    source : str,
+    offset : tuple = None,
+    alignRegions : bool = False,
+    workers : int = None,
+    compression : int = 2,
+    compressionMode : str = 'default',
+    samples : int = 8,
+    top : int = 10
+):
+    """Estimate the cost of fusing <source> into <destination>, without moving anything
+    
+    Arguments are the same as fuse, plus :
+    <samples> : Number of chunks moved in memory per source region, spread evenly across it
+    <top> : Number of heaviest regions and entity IDs to report
+    
+    Sampled chunks go through every stage of move_region, each timed on its own,
+    and totals are projected from the chunk count of every region, see Dimension.occupancy.
+    Writes are timed on a file in the system's temporary folder, and peak memory is measured with tracemalloc
+    on a second pass over sampled chunks, as tracing slows everything down.
+    
+    The only files written to either world are the indexes Dimension.occupancy keeps in each dimension folder,
+    named Dimension.occupancyFileName, which fuse writes as well.
+    
+    Return a dict of :
+    'offset'    : Nether offset which would be used
+    'chunks'    : Number of chunks to be moved, 'sampledChunks' being the number actually moved
+    'stages'    : 'seconds' spent in and 'bytes' output by each stage, over sampled chunks
+    'projected' : Estimated 'seconds' of the chunk transfer, from 'cpuSeconds' and 'writeSeconds',
+                  'bytesWritten' and 'peakMemory' in bytes
+    'regions'   : <top> regions with the most projected seconds, as {'dimension', 'region', 'chunks', 'seconds', 'bytes'}
+    'entities'  : <top> entity and tile entity IDs with the most bytes in sampled chunks, as {'id', 'count', 'bytes'}
+    """
+    
+    if compressionMode not in levels:
+        raise ValueError(f'Compression mode must be one of {list(levels)}, not {compressionMode}')
+    
+    codec = get_codec(compression)
+    level = levels[compressionMode]
+    
+    destination = World.from_saves(destination)
+    source = World.from_saves(source)
+    
+    if offset is None:
+        step = McaFile.sideLength if alignRegions else 1
+        offset = find_offsets(destination, source, step = step)
+    
+    mapDimensions = source.maps.dimensions()
+    
+    stages = {name : {'seconds' : 0.0, 'bytes' : 0} for name in ['read', 'decompress', 'decode', 'relocate', 'encode', 'compress']}
+    entities = {}
+    regions = []
+    
+    sampled = []
+    # (relocation, data, compression) of every sampled chunk, moved again to measure memory
+    
+    moved = []
+    # Compressed output of every sampled chunk, written to time writes
+    
+    def timed(name, function, *args):
+        """Return duration and result of function(*args), adding the duration to stage <name>"""
+        startTime = time.perf_counter()
+        result = function(*args)
+        elapsedTime = time.perf_counter() - startTime
+        stages[name]['seconds'] += elapsedTime
+        return elapsedTime, result
+    
+    def count_entities(tags):
+        """Add one and the encoded size of each of <tags> to its ID in <entities>"""
+        for tag in tags:
+            ID = str(tag['id']) if 'id' in tag else 'unknown'
+            count, size = entities.get(ID, (0, 0))
+            entities[ID] = (count + 1, size + len(tag.to_bytes()))
+    
+    for dimensionName, dimension in source.dimensions.items():
+        
+        if dimensionName not in Relocation.scales:
+            continue
+        
+        relocation = Relocation(
+            netherOffset = offset,
+            mapIdOffset = len(destination.maps),
+            mapDimensions = mapDimensions,
+            dimension = dimensionName
+        )
+        
+        logging.info(f'Sampling regions of {dimensionName}...')
+        stats = dimension.region_stats()
+        
+        for key, occupancy in dimension.occupancy().items():
+            
+            chunkKeys = [i for i in range(McaFile.sideLength ** 2) if occupancy >> i & 1]
+            
+            if chunkKeys == []:
+                continue
+            
+            sampleKeys = sorted(set([chunkKeys[i * len(chunkKeys) // samples] for i in range(min(samples, len(chunkKeys)))]))
+            
+            readTime, sourceFile = timed('read', McaFile.open, dimension.region_path(key))
+            stages['read']['bytes'] += stats[key][0]
+            
+            chunkTime = 0
+            chunkBytes = 0
+            
+            for chunkKey in sampleKeys:
+                
+                data, chunkCompression = sourceFile.load_data(chunkKey)
+                sampled.append((relocation, data, chunkCompression))
+                
+                elapsedTime, raw = timed('decompress', get_codec(chunkCompression).decompress, data)
+                chunkTime += elapsedTime
+                stages['decompress']['bytes'] += len(raw)
+                
+                elapsedTime, chunk = timed('decode', Chunk.from_bytes, raw)
+                chunkTime += elapsedTime
+                stages['decode']['bytes'] += len(raw)
+                
+                count_entities(chunk['']['Level'].get('Entities', []))
+                count_entities(chunk['']['Level'].get('TileEntities', []))
+                
+                elapsedTime, chunk = timed('relocate', relocation.chunk, chunk)
+                chunkTime += elapsedTime
+                stages['relocate']['bytes'] += len(raw)
+                
+                elapsedTime, encoded = timed('encode', chunk.to_bytes)
+                chunkTime += elapsedTime
+                stages['encode']['bytes'] += len(encoded)
+                
+                elapsedTime, data = timed('compress', codec.compress, encoded, level)
+                chunkTime += elapsedTime
+                stages['compress']['bytes'] += len(data)
+                
+                chunkBytes += len(data)
+                moved.append(data)
+            
+            regions.append({
+                'dimension' : dimensionName,
+                'region' : key,
+                'chunks' : len(chunkKeys),
+                'seconds' : readTime + chunkTime * len(chunkKeys) / len(sampleKeys),
+                'bytes' : chunkBytes * len(chunkKeys) // len(sampleKeys),
+                'fileSize' : stats[key][0]
+            })
+    
+    logging.info(f'Timing writes of {len(moved):,} chunks...')
+    with tempfile.TemporaryFile() as f:
+        startTime = time.perf_counter()
+        for data in moved:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        writeTime = time.perf_counter() - startTime
+    
+    logging.info(f'Measuring memory of {len(sampled):,} chunks...')
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    
+    chunkMemory = 0
+    for relocation, data, chunkCompression in sampled:
+        tracemalloc.reset_peak()
+        baseMemory = tracemalloc.get_traced_memory()[0]
+        codec.compress(relocation.chunk(McaFile.decode_chunk(data, chunkCompression)).to_bytes(), level)
+        chunkMemory = max(chunkMemory, tracemalloc.get_traced_memory()[1] - baseMemory)
+    
+    if not tracing:
+        tracemalloc.stop()
+    
+    workerCount = workers or os.cpu_count() or 1
+    batchSize = 4 * workerCount
+    # Same as in fuse
+    
+    bytesWritten = sum([region['bytes'] for region in regions])
+    cpuTime = sum([region['seconds'] for region in regions])
+    writeTime = writeTime * bytesWritten / max(stages['compress']['bytes'], 1)
+    
+    peakMemory = (
+        # Each worker holds a whole source region file and the chunk being moved
+        workerCount * (max([region['fileSize'] for region in regions], default = 0) + chunkMemory)
+        # Moved chunks of a whole batch are routed through the main process
+      + sum(sorted([region['bytes'] for region in regions], reverse = True)[:batchSize])
+    )
+    
+    report = {
+        'offset' : tuple(offset),
+        'chunks' : sum([region['chunks'] for region in regions]),
+        'sampledChunks' : len(sampled),
+        'stages' : stages,
+        'projected' : {
+            'seconds' : (cpuTime + writeTime) / workerCount,
+            'cpuSeconds' : cpuTime,
+            'writeSeconds' : writeTime,
+            'bytesWritten' : bytesWritten,
+            'peakMemory' : peakMemory
+        },
+        'regions' : [
+            {key : value for key, value in region.items() if key != 'fileSize'}
+            for region in sorted(regions, key = lambda region : region['seconds'], reverse = True)[:top]
+        ],
+        'entities' : [
+            {'id' : ID, 'count' : count, 'bytes' : size}
+            for ID, (count, size) in sorted(entities.items(), key = lambda item : item[1][1], reverse = True)[:top]
+        ]
+    }
+    
+    logging.info(f'Sampled {report["sampledChunks"]:,} of {report["chunks"]:,} chunks at offset {report["offset"]}')
+    for name, stage in stages.items():
+        logging.info(f'{name:>10} : {stage["seconds"]:8.3f}s {stage["bytes"]:14,} bytes')
+    
+    logging.info(
+        f'Projected {report["projected"]["seconds"]:,.0f}s with {workerCount} workers'
+        f', {bytesWritten:,} bytes written, {peakMemory:,} bytes of memory at most'
+    )
+    for region in report['regions']:
+        logging.info(f'{region["dimension"]} {region["region"]} : {region["chunks"]:,} chunks, {region["seconds"]:,.1f}s')
+    for entity in report['entities']:
+        logging.info(f'{entity["id"]} : {entity["count"]:,} sampled, {entity["bytes"]:,} bytes')
+    
+    return report
+
+def find_offsets(destination : World, source : World, step : int = 1):
+    """Find offsets with no conflicts to fuse the Overworld and Nether of <destination> and <source>
+    
+    <step> : Only try nether offsets that are multiples of this many chunks
+    
+    Overlaps for all offsets at once are found on maps downsampled to cells of <step> chunks,
+    or wider ones for worlds too large to have less than <offsetGridSize> offsets.
+    The closest offset free on those is returned, after being checked at full resolution.
+    It can be a few cells further than strictly needed, for the sake of not trying offsets one by one.
+    """
     
     logging.info('Mapping destination overworld...')
     destinationOverworld = map_and_boundaries(destination.dimensions['minecraft:overworld'])
@@ -34,466 +268,372 @@ def find_offsets(destination : World, source : World):
     logging.info('Mapping source nether...')
     graftNether = map_and_boundaries(source.dimensions['minecraft:the_nether'])
     
+    dimensions = [
+        (destinationMap, graftMap, scale)
+        for destinationMap, graftMap, scale in [
+            (destinationNether, graftNether, 1),
+            (destinationOverworld, graftOverworld, 8)
+        ]
+        if destinationMap is not None and graftMap is not None
+    ]
+    
+    # Nether cells of <cell> chunks, overworld cells 8 times wider, so both share the same grid of offsets
+    # Cells get wider until there are few enough offsets to compute overlaps for quickly
+    cell = step
+    while any([
+        ((destinationMap.bounds[1] - destinationMap.bounds[0] + graftMap.bounds[1] - graftMap.bounds[0]) // (cell * scale) + 3)
+      * ((destinationMap.bounds[3] - destinationMap.bounds[2] + graftMap.bounds[3] - graftMap.bounds[2]) // (cell * scale) + 3)
+      > offsetGridSize
+        for destinationMap, graftMap, scale in dimensions
+    ]):
+        cell *= 2
+    
+    logging.info(f'Computing overlaps for every offset, {cell} chunks apart...')
+    blocked = util.Bitmap()
+    for destinationMap, graftMap, scale in dimensions:
+        
+        if cell > step:
+            # Offsets inside of a cell move source chunks at most one more cell away
+            graftCells = graftMap.dilated(cell * scale)
+        else:
+            graftCells = graftMap.level(cell * scale)
+        
+        blocked |= destinationMap.level(cell * scale).overlap_offsets(graftCells)
+    
     logging.info(f'Trying offsets...')
-    for netherOffset in generate_offsets():
+    for cellOffset in generate_offsets():
         
-        # Finding offset for the nether first makes the process faster
-        # The nether is usually 8 times smaller than the overworld, and roughly the same shape
-        # Thus, there is a very high chance a given nether offset will work for the overworld too
-        # And it will be up to 8 times quicker to find !
+        # Offsets past the edges of <blocked> are always free, so this always ends
+        if blocked[cellOffset]:
+            continue
         
+        # Every nether offset of a free cell is free, so take the closest one to the origin
+        netherOffset = tuple([min(max(0, i * cell), i * cell + cell - step) for i in cellOffset])
+        overworldOffset = tuple([i*8 for i in netherOffset])
+        
+        # Coarse maps only ever find too many conflicts, but this also checks the world border
         if not offset_conflicts(
             destination = destinationNether, 
             source = graftNether, 
             offset = netherOffset
+        ) and not offset_conflicts(
+            destination = destinationOverworld, 
+            source = graftOverworld, 
+            offset = overworldOffset
         ):
-            overworldOffset = tuple([i*8 for i in netherOffset])
-            if not offset_conflicts(
-                destination = destinationOverworld, 
-                source = graftOverworld, 
-                offset = overworldOffset
-            ):
             
-                logging.info(f'Found {netherOffset} Nether, {overworldOffset} Overworld.')
-                return netherOffset
+            logging.info(f'Found {netherOffset} Nether, {overworldOffset} Overworld.')
+            return netherOffset
 
-def fuse(destination : str, source : str, offset : tuple = None):
+def fuse(
+    destination : str, 
+    source : str, 
+    offset : tuple = None, 
+    alignRegions : bool = False, 
+    workers : int = None,
+    resume : bool = True,
+    compression : int = 2,
+    compressionMode : str = 'default',
+    dryRun : bool = False
+):
     """Fuse <source> into <destination>. Takes a REALLY long time !
     Offset for <source> will be found automatically if <offset> is None
     
     <destination>  : Name in .minecraft/saves of the map into which to fuse <source>
     <source> : Name in .minecraft/saves of the map to fuse into <destination>
     <offset>: Tuple of two ints (xNether, zNether) representing the NETHER chunk offset of <source>. The overworld will be moved 8x as far to keep the portals connected
+    <alignRegions> : Only look for offsets that are multiples of 32 chunks, so that whole regions can be moved at once
+    <workers> : Number of worker processes shared by the whole run, defaults to the number of CPUs
+    <resume> : Continue an interrupted fusion of <source> into <destination> where it stopped.
+               If False, any progress of an interrupted fusion is forgotten.
+    <compression> : ID of the codec used for moved chunks, see compression.codecs
+    <compressionMode> : Key of compression.levels used for moved chunks, 'fast' or 'small' for instance
+    <dryRun> : Write nothing, only return the estimated cost of this fusion, see estimate_fuse
+    
+    Set util.metrics.enabled beforehand to record where time goes, see util.Metrics
+    
+    Source regions are moved in batches by worker processes, which route moved chunks to their destination region.
+    Destination regions are then written in parallel, each by a single worker.
+    If the offset of a dimension is a multiple of 32 chunks, each source region lands exactly on a destination region.
+    Chunks then keep their index inside their file, and each destination file is written only once.
     """
     
-    def update_entity(entity):
-        """Update an entity's data.
-        
-        Separated into its own function for recursive calls
-        """
-        entity['Pos'][0] += xBlock
-        entity['Pos'][2] += zBlock
-        
-        
-        for key in entity:
-        
-            if key == 'UUID':
-                for i, _ in enumerate(entity['UUID']):
-                    entity['UUID'][i] = TAG.Int(random.randint(-2_147_483_648, 2_147_483_647))
-        
-            if key == 'Passengers':
-                for passengerIdx, passenger in enumerate(entity['Passengers']):
-                    entity['Passengers'][passengerIdx] = update_entity(passenger)
-               
-            elif key == 'TileEntityData':
-                entity['TileEntityData'] = update_tile_entity(entity['TileEntityData'])
-               
-            elif key == 'Brain':
-                for memKey in entity['Brain']['memories']:
-                    if memKey in [
-                        'minecraft:home',
-                        'minecraft:job_site',
-                        'minecraft:meeting_point',
-                        'minecraft:potential_job_site'
-                    ]:
-                        memory = entity['Brain']['memories'][memKey]
-                        
-                        if memory['value']['dimension'] == 'minecraft:overworld':
-                            memory['value']['pos'][0] += xBlockOverworld
-                            memory['value']['pos'][2] += zBlockOverworld
-                            
-                        elif memory['value']['dimension'] == 'minecraft:the_nether':
-                            memory['value']['pos'][0] += xBlockNether
-                            memory['value']['pos'][2] += zBlockNether
-                        
-                        entity['Brain']['memories'][memKey] = memory
-                
-            elif key == 'Item':
-                if 'id' in entity['Item']:
-                    if entity['Item']['id'] == 'minecraft:filled_map':
-                        entity['Item'] = update_map_item(entity['Item'])
-                
-            elif key in [
-                'ArmorItems',
-                'HandItems', 
-                'Inventory',
-                'Items'
-            ]:
-                for itemIdx, item in enumerate(entity[key]):
-                    if 'id' in item:
-                        if item['id'] == 'minecraft:filled_map':
-                            entity[key][itemIdx] = update_map_item(item)
+    cacheSize = 2048
+    # Number of chunks to be moved before clearing caches
+    
+    get_codec(compression)
+    # Fail before doing anything if the codec is unknown
+    
+    if compressionMode not in levels:
+        raise ValueError(f'Compression mode must be one of {list(levels)}, not {compressionMode}')
+    
+    if dryRun:
+        return estimate_fuse(
+            destination = destination,
+            source = source,
+            offset = offset,
+            alignRegions = alignRegions,
+            workers = workers,
+            compression = compression,
+            compressionMode = compressionMode
+        )
+    
+    # Workers are stopped even if the fusion fails partway
+    with util.Executor(workers = workers) as executor:
+        
+        destination = World.from_saves(destination, executor = executor)
+        source = World.from_saves(source, executor = executor)
+        
+        checkpoint = Checkpoint.open(destination.folder)
+        
+        if not resume:
+            checkpoint.delete()
+        
+        if 'source' in checkpoint:
             
-            elif key in [
-                'BeamTarget'
-                'FlowerPos',
-                'HivePos',
-                'Leash',
-                'PatrolTarget',
-                'WanderTarget'
-            ]:
-                if 'X' in entity[key]:
-                    entity[key]['X'] += xBlock
-                if 'Z' in entity[key]:
-                    entity[key]['Z'] += zBlock
-                
-            elif key in [
-                'AX',
-                'APX',
-                'BoundX',
-                'HomePosX',
-                'SleepingX',
-                'TileX',
-                'TravelPosX',
-                'TreasurePosX'
-            ]:
-                entity[key] += xBlock
-                
-            elif key in [
-                'AZ',
-                'APZ',
-                'BoundZ',
-                'HomePosZ',
-                'SleepingZ',
-                'TileZ',
-                'TravelPosZ',
-                'TreasurePosZ'
-            ]:
-                entity[key] += zBlock
-        
-        return entity
-    
-    def update_map_item(item):
-        """Updates a map item's contained positional data"""
-        if 'Decorations' in item['tag']:
-        
-            mapId = item['tag']['map']
-            mapDimension = source.maps[mapId]['']['data']['dimension']
+            if checkpoint['source'] != source.folder:
+                raise ValueError(
+                    f'{destination.folder} has an unfinished fusion with {checkpoint["source"]}'
+                    ', finish it or use resume = False'
+                )
+            
+            if offset is not None and tuple(offset) != tuple(checkpoint['offset']):
+                raise ValueError(f'Cannot resume fusion at {offset}, it was started at {checkpoint["offset"]}')
             
-            if isinstance(mapDimension, TAG.Byte):
-                if mapDimension == 0:
-                    mapDimension = 'minecraft:overworld'
-                elif mapDimension == -1:
-                    mapDimension = 'minecraft:the_nether'
-                elif mapDimension == 1:
-                    mapDimension = 'minecraft:the_end'
+            offset = checkpoint['offset']
+            logging.info(f'Resuming fusion at offset {offset}...')
+        
+        if offset is None:
+            step = McaFile.sideLength if alignRegions else 1
+            xChunkNether, zChunkNether = find_offsets(destination, source, step = step)
+        else:
+            xChunkNether, zChunkNether = offset
+        
+        checkpoint['source'] = source.folder
+        checkpoint['offset'] = [xChunkNether, zChunkNether]
+        checkpoint.save()
+        
+        xBlockNether = xChunkNether * 16
+        zBlockNether = zChunkNether * 16
+        
+        xChunkOverworld = xChunkNether * 8
+        zChunkOverworld = zChunkNether * 8
+        
+        xBlockOverworld = xChunkOverworld * 16
+        zBlockOverworld = zChunkOverworld * 16
+        
+        
+        if 'mapIdOffset' not in checkpoint:
+            checkpoint['mapIdOffset'] = len(destination.maps)
+            checkpoint.save()
+        
+        mapIdOffset = checkpoint['mapIdOffset']
+        
+        if 'mapsDone' not in checkpoint:
             
-            for decorationIdx, decoration in enumerate(item['tag']['Decorations']):
+            mapCount = len(source.maps)
+            logging.info(f'Transferring {mapCount:,} Maps...')
             
+            def move_map(i, m):
+                """Return destination ID and moved map <m> from source ID <i>"""
+                
+                mapDimension = source.maps.dimension_name(m['']['data']['dimension'])
+                
                 if mapDimension == 'minecraft:overworld':
-                    decoration['x'] += xBlockOverworld
-                    decoration['z'] += zBlockOverworld
-                    
+                    xBlock = xBlockOverworld
+                    zBlock = zBlockOverworld
                 elif mapDimension == 'minecraft:the_nether':
-                    decoration['x'] += xBlockNether
-                    decoration['z'] += zBlockNether
+                    xBlock = xBlockNether
+                    zBlock = zBlockNether
+                else:
+                    logging.warning(f'Did not offset map {i} from dimension {mapDimension}')
+                    xBlock = 0
+                    zBlock = 0
+                    # Other dimensions are not transferred, so we don't offset their maps
                 
-                item['tag']['Decorations'][decorationIdx] = decoration
-        
-        item['tag']['map'] += mapIdOffset
-        return item
-    
-    def update_tile_entity(tile):
-        
-        for key in tile:
-        
-            if key == 'x':
-                tile['x'] += xBlock
+                m['']['data']['xCenter'] += xBlock
+                m['']['data']['zCenter'] += zBlock
                 
-            elif key == 'z':
-                tile['z'] += zBlock
+                if 'banners' in m['']['data']:
+                    for bannerIdx, banner in enumerate(m['']['data']['banners']):
+                        banner['Pos']['X'] += xBlock
+                        banner['Pos']['Z'] += zBlock
+                        m['']['data']['banners'][bannerIdx] = banner
                 
-            elif key == 'Items':
-                for itemIdx, item in enumerate(tile['Items']):
-                    if 'id' in item:
-                        if item['id'] == 'minecraft:filled_map':
-                            tile['Items'][itemIdx] = update_map_item(item)
+                if 'frames' in m['']['data']:
+                    for frameIdx, frame in enumerate(m['']['data']['frames']):
+                        frame['Pos']['X'] += xBlock
+                        frame['Pos']['Z'] += zBlock
+                        m['']['data']['frames'][frameIdx] = frame
                 
-            elif key in ['ExitPortal', 'FlowerPos']:
-                tile[key]['X'] += xBlock
-                tile[key]['Z'] += zBlock
-        
-        return tile
-    
-    def move_chunk(chunk):
-        """Move chunk from source to destination"""
-        
-        def update_BB(BB):
-            """Return updated bounding box for a Start or a Child
-            
-            Display an info message if a corrupted bounding box is found
-            """
-            for i in BB:
-                if i > Dimension.sideLength:
-                    x = chunk['']['Level']['xPos'] - xChunk
-                    z = chunk['']['Level']['zPos'] - zChunk
-                    logging.warning(
-                        f'Transferring possibly corrupted structure bounding-box in chunk {x} {z} as-is'
-                    )
-                    break
-            else:
-                BB[0] += xBlock
-                BB[2] += zBlock
-                BB[3] += xBlock
-                BB[5] += zBlock
+                return mapIdOffset + i, m
             
-            return BB
-        
-        chunk['']['Level']['xPos'] += xChunk
-        chunk['']['Level']['zPos'] += zChunk
-        
-        if 'Entities' in chunk['']['Level']:
-            for i, entity in enumerate(chunk['']['Level']['Entities']):
-                chunk['']['Level']['Entities'][i] = update_entity(entity)
-       
-        if 'TileEntities' in chunk['']['Level']:
-            for i, tile in enumerate(chunk['']['Level']['TileEntities']):
-                chunk['']['Level']['TileEntities'][i] = update_tile_entity(tile)
-        
-        if 'TileTicks' in chunk['']['Level']:
-            for i, tick in enumerate(chunk['']['Level']['TileTicks']):
-                tick['x'] += xBlock
-                tick['z'] += zBlock
+            # idcounts is written once, after every map. Maps land on fixed IDs, so they can be written again when resuming
+            with util.metrics.span('fuse_maps_seconds'), destination.maps:
+                
+                if mapCount > 0:
+                    destination.maps.idcounts = max(destination.maps.idcounts, mapIdOffset + mapCount - 1)
+                
+                destination.maps.write_all(move_map(i, m) for i, m in source.maps.items())
             
-                chunk['']['Level']['TileTicks'][i] = tick
+            checkpoint['mapsDone'] = True
+            checkpoint.save()
         
-        if 'LiquidTicks' in chunk['']['Level']:
-            for i, tick in enumerate(chunk['']['Level']['LiquidTicks']):
-                tick['x'] += xBlock
-                tick['z'] += zBlock
+        if 'playersDone' not in checkpoint:
             
-                chunk['']['Level']['LiquidTicks'][i] = tick
-        
-        if 'Structures' in chunk['']['Level']:
-        
-            # Update References
-            if 'References' in chunk['']['Level']['Structures']:
-                for key, reference in chunk['']['Level']['Structures']['References'].items():
-                    if reference != []:
-                        for i, coords in enumerate(reference):
-                            x = TAG.Int()
-                            z = TAG.Int()
-                            
-                            x.unsigned = util.get_bits(coords,  0, 32)
-                            z.unsigned = util.get_bits(coords, 32, 64)
-                            x += xChunk
-                            z += zChunk
-                            coords.unsigned = util.set_bits(coords.unsigned, 0, 32, x)
-                            coords.unsigned = util.set_bits(coords.unsigned, 32, 64, z)
-                            
-                            reference[i] = coords
-                        
-                        chunk['']['Level']['Structures']['References'][key] = reference
+            transferred = set(checkpoint.value.setdefault('players', []))
+            uuids = [uuid for uuid in source.players if uuid not in transferred]
+            logging.info(f'Transferring {len(uuids):,} Players...')
             
-            # Update Starts
-            if 'Starts' in chunk['']['Level']['Structures']:
-                for startKey, start in chunk['']['Level']['Structures']['Starts'].items():
-                    if start['id'] != 'INVALID':
+            def move_players():
+                """Generate (uuid, player) of moved players, read several at once"""
+                
+                for uuid, player in source.players.items(uuids):
                     
-                        if 'BB' in start:
-                            start['BB'] = update_BB(start['BB'])
-                        
-                        if 'ChunkX' in start:
-                            start['ChunkX'] += xChunk
-                            
-                        if 'ChunkZ' in start:
-                            start['ChunkZ'] += zChunk
-                        
-                        if 'Children' in start:
-                            for i, child in enumerate(start['Children']):
-                            
-                                child['BB'] = update_BB(child['BB'])
-                                
-                                for key in child:
-                                    if key == 'Entrances':
-                                        for iEntrance, entrance in enumerate(child['Entrances']):
-                                            entrance[0] += xBlock
-                                            entrance[2] += zBlock
-                                            entrance[3] += xBlock
-                                            entrance[5] += zBlock
-                                            child['Entrances'][iEntrance] = entrance
-                                        
-                                    elif key == 'junctions':
-                                        for iJunction, junction in enumerate(child['junctions']):
-                                            junction['source_x'] += xBlock
-                                            junction['source_z'] += zBlock
-                                            child['junctions'][iJunction] = junction
-                                        
-                                    elif key in ['PosX', 'TPX']:
-                                        child[key] += xBlock
-                                        
-                                    elif key in ['PosZ', 'TPZ']:
-                                        child[key] += zBlock
-                                
-                                start['Children'][i] = child
-                        
-                        if 'Processed' in start:
-                            for i, process in enumerate(start['Processed']):
-                                process['X'] += xChunk
-                                process['Z'] += zChunk
-                                start['Processed'][i] = process
+                    dimension = player['playerdata']['']['Dimension']
+                    
+                    if dimension == -1 or dimension == 'minecraft:the_nether':
+                        xBlock = xBlockNether
+                        zBlock = zBlockNether
+                    elif dimension == 0  or dimension == 'minecraft:overworld':
+                        xBlock = xBlockOverworld
+                        zBlock = zBlockOverworld
+                    else:
+                        # Other dimensions are not transferred, so players inside of them are discarded
+                        continue
+                    
+                    player['playerdata']['']['Pos'][0] += xBlock
+                    player['playerdata']['']['Pos'][2] += zBlock
+                    
+                    if 'SpawnX' in player['playerdata'][''] and 'SpawnZ' in player['playerdata']['']:
+                        if (
+                            'SpawnDimension' in player['playerdata']['']
+                            and player['playerdata']['']['SpawnDimension'] == 'minecraft:the_nether'
+                        ):
+                            xBlock = xBlockNether
+                            zBlock = zBlockNether
+                        else:
+                            xBlock = xBlockOverworld
+                            zBlock = zBlockOverworld
                         
-                        chunk['']['Level']['Structures']['Starts'][startKey] = start
-    
-        destination.dimensions[dimensionName][chunk.coords_chunk] = chunk
-    
-    cacheSize = 2048
-    # Number of chunks to be moved before clearing caches
-    
-    destination = World.from_saves(destination)
-    source = World.from_saves(source)
-    
-    if offset is None:
-        xChunkNether, zChunkNether = find_offsets(destination, source)
-    else:
-        xChunkNether, zChunkNether = offset
-    
-    xBlockNether = xChunkNether * 16
-    zBlockNether = zChunkNether * 16
-    
-    xChunkOverworld = xChunkNether * 8
-    zChunkOverworld = zChunkNether * 8
-    
-    xBlockOverworld = xChunkOverworld * 16
-    zBlockOverworld = zChunkOverworld * 16
-    
-    
-    mapIdOffset = len(destination.maps)
-    
-    logging.info(f'Transferring {len(source.maps):,} Maps...')
-    for i, m in enumerate(source.maps):
-        
-        mapDimension = m['']['data']['dimension']
-        
-        if mapDimension == 0:
-            mapDimension = 'minecraft:overworld'
+                        player['playerdata']['']['SpawnX'] += xBlock
+                        player['playerdata']['']['SpawnZ'] += zBlock
+                    
+                    yield uuid, player
             
-        elif mapDimension == -1:
-            mapDimension = 'minecraft:the_nether'
+            # Advancements and stats are never read, so they are copied as-is
+            with util.metrics.span('fuse_players_seconds'):
+                for uuid in destination.players.write_all(move_players()):
+                    util.metrics.count('fuse_players_total')
+                    checkpoint['players'].append(uuid)
+                    if len(checkpoint['players']) % cacheSize == 0:
+                        checkpoint.save()
             
-        elif mapDimension == 1:
-            mapDimension = 'minecraft:the_end'
-        
-        if mapDimension == 'minecraft:overworld':
-            xBlock = xBlockOverworld
-            zBlock = zBlockOverworld
-        elif mapDimension == 'minecraft:the_nether':
-            xBlock = xBlockNether
-            zBlock = zBlockNether
-        else:
-            logging.warning(f'Did not offset map {i} from dimension {mapDimension}')
-            xBlock = 0
-            zBlock = 0
-            # Other dimensions are not transferred, so we don't offset their maps
-        
-        m['']['data']['xCenter'] += xBlock
-        m['']['data']['zCenter'] += zBlock
+            checkpoint['playersDone'] = True
+            checkpoint.save()
+        
+        resuming = 'regions' in checkpoint
+        # Chunks of unfinished regions may already have been written by an interrupted run
+        
+        checkpoint.value.setdefault('regions', {})
+        checkpoint.save()
+        
+        worldChunkTotal = 0
+        for dimensionName in Relocation.scales:
+            done = checkpoint.done_regions(dimensionName)
+            # Only the header of each region is read, see Dimension.occupancy
+            for key, occupancy in source.dimensions[dimensionName].occupancy().items():
+                if key not in done:
+                    worldChunkTotal += occupancy.bit_count()
 
-        if 'banners' in m['']['data']:
-            for i, banner in enumerate(m['']['data']['banners']):
-                banner['Pos']['X'] += xBlock
-                banner['Pos']['Z'] += zBlock
-                m['']['data']['banners'][i] = banner
-        
-        if 'frames' in m['']['data']:
-            for i, frame in enumerate(m['']['data']['frames']):
-                frame['Pos']['X'] += xBlock
-                frame['Pos']['Z'] += zBlock
-                m['']['data']['frames'][i] = frame
-        
-        destination.maps.append(m)
-    
-    logging.info(f'Transferring {len(source.players):,} Players...')
-    for uuid, player in source.players.items():
-    
-        dimension = player['playerdata']['']['Dimension']
-        
-        if dimension == -1 or dimension == 'minecraft:the_nether':
-            xBlock = xBlockNether
-            zBlock = zBlockNether
-        if dimension == 0  or dimension == 'minecraft:overworld':
-            xBlock = xBlockOverworld
-            zBlock = zBlockOverworld
-        else:
-            # Other dimensions are not transferred, so players inside of them are discarded
-            continue
-        
-        player['playerdata']['']['Pos'][0] += xBlock
-        player['playerdata']['']['Pos'][2] += zBlock
+        logging.info(f'Counted {worldChunkTotal:,} chunks to be transferred')
         
-        if 'SpawnX' in player['playerdata'][''] and 'SpawnZ' in player['playerdata']['']:
-            if (
-                'SpawnDimension' in player['playerdata']['']
-                and player['playerdata']['']['SpawnDimension'] == 'minecraft:the_nether'
-            ):
-                xBlock = xBlockNether
-                zBlock = zBlockNether
-            else:
-                xBlock = xBlockOverworld
-                zBlock = zBlockOverworld
+        progress = 0
+        startTime = time.perf_counter()
         
-            player['playerdata']['']['SpawnX'] += xBlock
-            player['playerdata']['']['SpawnZ'] += zBlock
+        def log_progress():
+            """Log progress and estimated time of completion"""
+            elapsedTime = time.perf_counter() - startTime
+            remainingTime = (elapsedTime / max(progress, 1)) * (worldChunkTotal - progress)
+            completionTime = time.strftime(datefmt, time.localtime(time.time() + remainingTime))
+            
+            completion = progress / max(worldChunkTotal, 1)
+            completionStr = f'{progress:8,}/{worldChunkTotal:8,}'
+            
+            logging.info(f'{completionStr} - {completion:6.2%} - ETC : {completionTime}')
         
-        destination.players[uuid] = player
-    
-    worldChunkTotal = 0
-    for dimensionName, dimension in source.dimensions.items():
-        if (
-               dimensionName == 'minecraft:overworld' 
-            or dimensionName == 'minecraft:the_nether'
-        ):
-            worldChunkTotal += len(dimension)
-
-    logging.info(f'Counted {worldChunkTotal:,} chunks to be transferred')
-    
-    cacheSize = 2048
-    progress = 0
-    startTime = time.perf_counter()
-    
-    for dimensionName, dimension in source.dimensions.items():
-    
-        if dimensionName == 'minecraft:overworld':
-            xBlock = xBlockOverworld
-            zBlock = zBlockOverworld
-            xChunk = xChunkOverworld
-            zChunk = zChunkOverworld
-        elif dimensionName == 'minecraft:the_nether':
-            xBlock = xBlockNether
-            zBlock = zBlockNether
-            xChunk = xChunkNether
-            zChunk = zChunkNether
-        else:
-            # Transferring other dimensions is not supported
-            continue
+        batchSize = 4 * (workers or os.cpu_count() or 1)
+        # Number of source regions moved before their chunks are written to the destination
         
-        dimensionChunkTotal = len(dimension)
-        logging.info(f'Transferring {dimensionChunkTotal:,} chunks from {dimensionName}...')
+        relocation = Relocation(
+            netherOffset = (xChunkNether, zChunkNether),
+            mapIdOffset = mapIdOffset,
+            mapDimensions = source.maps.dimensions()
+        )
+        # Map dimensions are read once, rather than for every map item found in chunks
         
-        for i, chunk in enumerate(dimension):
+        for dimensionName, dimension in source.dimensions.items():
         
-            move_chunk(chunk)
+            if dimensionName not in Relocation.scales:
+                # Transferring other dimensions is not supported
+                continue
             
-            if (i + 1) % cacheSize == 0:
+            dimensionRelocation = relocation.for_dimension(dimensionName)
             
-                destination.dimensions[dimensionName].save_all()
+            done = checkpoint.done_regions(dimensionName)
+            regions = sorted(
+                [key for key in dimension.regions() if key not in done],
+                key = lambda key : (key[1], key[0])
+            )
+            # Neighbouring source regions share destination regions, keeping them in the same batch
+            # means those destination regions are written fewer times
+            
+            logging.info(f'Transferring {len(regions):,} regions from {dimensionName}...')
+            
+            destinationDimension = destination.dimensions[dimensionName]
+            
+            for batchStart in range(0, len(regions), batchSize):
+                
+                batch = regions[batchStart : batchStart + batchSize]
+                
+                routes = {}
+                # Moved (key, data, compression) chunks of each destination region
+                
+                # Metrics recorded by workers are merged into those of this process
+                with util.metrics.span('fuse_move_seconds', dimension = dimensionName):
+                    for moved in util.metrics.map(
+                        executor,
+                        move_region,
+                        [dimension.region_path(key) for key in batch],
+                        itertools.repeat(dimensionRelocation),
+                        itertools.repeat(compression),
+                        itertools.repeat(levels[compressionMode])
+                    ):
+                        for key, chunks in moved.items():
+                            routes.setdefault(key, []).extend(chunks)
+                            progress += len(chunks)
+                            util.metrics.count('fuse_chunks_total', len(chunks), dimension = dimensionName)
                 
-                progress += cacheSize
-                elapsedTime = time.perf_counter() - startTime
-                remainingTime = (elapsedTime / progress) * (worldChunkTotal - progress)
-                completionTime = time.strftime(datefmt, time.localtime(time.time() + remainingTime))
+                # Each destination region is written by exactly one worker
+                with util.metrics.span('fuse_write_seconds', dimension = dimensionName):
+                    for _ in util.metrics.map(
+                        executor,
+                        write_region,
+                        [destinationDimension.region_path(key) for key in routes],
+                        routes.values(),
+                        itertools.repeat(resuming)
+                    ):
+                        pass
                 
-                completion = progress / worldChunkTotal
-                completionStr = f'{progress:8,}/{worldChunkTotal:8,}'
+                checkpoint.mark_done(dimensionName, batch)
+                checkpoint.save()
                 
-                logging.info(f'{completionStr} - {completion:6.2%} - ETC : {completionTime}')
+                log_progress()
             
-            if i + 1 == dimensionChunkTotal:
-                progress += (i + 1) % cacheSize
-                destination.dimensions[dimensionName].save_all()
-                logging.info(f'Finished transferring {dimensionChunkTotal:,} chunks from {dimensionName} !')
-    
-    logging.info(f'Transfer done !')
+            logging.info(f'Finished transferring {len(regions):,} regions from {dimensionName} !')
+        
+        checkpoint.delete()
+        logging.info(f'Transfer done !')
 
 def fusion_map(
     destination : str, 
@@ -523,58 +663,33 @@ def fusion_map(
         xOffset *= 8
         zOffset *= 8
     
-    aMap, *_ = map_and_boundaries(destination.dimensions[dimension])
-    bMap, *_ = map_and_boundaries(source.dimensions[dimension])
-    
-    if len(source.dimensions[dimension]) > len(destination.dimensions[dimension]):
-        # Invert maps and offsets if source is bigger than destination
-        aMap, bMap = bMap, aMap
-        xOffset *= -1
-        zOffset *= -1
+    aMap = destination.dimensions[dimension].pyramid()
+    bMap = source.dimensions[dimension].pyramid()
     
     sideLen = McaFile.sideLength
     
     logging.info(f'Combining maps...')
     
-    fuseMap = aMap
-    for coords, region in bMap.items():
-        xRegion, zRegion = coords
-        for x, row in enumerate(region):
-            for z, chunk in enumerate(row):
-                realXregion, realXchunk = divmod(x + xOffset + xRegion*sideLen, sideLen)
-                realZregion, realZchunk = divmod(z + zOffset + zRegion*sideLen, sideLen)
-                
-                if (realXregion, realZregion) not in fuseMap:
-                    fuseMap[realXregion, realZregion] = [[0 for x in range(sideLen)] for z in range(sideLen)]
-                
-                if chunk:
-                    fuseMap[realXregion, realZregion][realXchunk][realZchunk] += 1
+    bounds = [i for i in [aMap.bounds, bMap.bounds] if i is not None]
     
-    x = []
-    z = []
-    for xRegion, zRegion in fuseMap:
-        x.append(xRegion)
-        z.append(zRegion)
+    if bMap.bounds is not None:
+        # Source is drawn where it will be pasted
+        xMin, xMax, zMin, zMax = bMap.bounds
+        bounds[-1] = (xMin + xOffset, xMax + xOffset, zMin + zOffset, zMax + zOffset)
     
     # Clamp borders at size if necessary
     limit = int(size / 64)
-    maxX  = min( limit, max(x))   
-    minX  = max(-limit, min(x))
-    maxZ  = min( limit, max(z))
-    minZ  = max(-limit, min(z))
+    maxX  = min( limit, max([i[1] - 1 for i in bounds]) // sideLen)
+    minX  = max(-limit, min([i[0] for i in bounds]) // sideLen)
+    maxZ  = min( limit, max([i[3] - 1 for i in bounds]) // sideLen)
+    minZ  = max(-limit, min([i[2] for i in bounds]) // sideLen)
     
     logging.info(f'Preparing PNG data...')
-    data = b""
-    for zRegion in range(minZ, maxZ + 1):
-        for zChunk in range(sideLen):
-            data += b"\0" # no filter for this scanline
-            for xRegion in range(minX, maxX + 1):
-                if (xRegion, zRegion) in fuseMap:
-                    for xChunk in range(sideLen):
-                        data += (fuseMap[xRegion, zRegion][xChunk][zChunk] * 127).to_bytes(1, 'big')
-                else:
-                    # Write a black strip if this region doesn't exist
-                    data += b'\x00' * sideLen
+    data = bytearray()
+    for z in range(minZ * sideLen, (maxZ + 1) * sideLen):
+        data += b"\0" # no filter for this scanline
+        for x in range(minX * sideLen, (maxX + 1) * sideLen):
+            data.append((aMap[x, z] + bMap[x - xOffset, z - zOffset]) * 127)
     
     height = (maxZ - minZ + 1) * sideLen
     width  = (maxX - minX + 1) * sideLen
@@ -635,109 +750,76 @@ def generate_offsets(minRadius : int = 0, maxRadius : int = 3_750_000):
         previousCircle = circle
 
 def map_and_boundaries(dimension : Dimension):
-    """Return binary map and boundaries of <dimension>"""
+    """Return a util.Pyramid of the chunks of <dimension>, which knows its own boundaries, or None if it is empty
     
-    binaryMap = dimension.binary_map()
-    if binaryMap == {}:
+    Pyramids are cached by Dimension.pyramid, so mapping the same world again is free
+    """
+    
+    pyramid = dimension.pyramid()
+    
+    if pyramid.bounds is None:
         return None
     
-    x = []
-    z = []
-    for xRegion, zRegion in binaryMap:
-        x.append(xRegion)
-        z.append(zRegion)
+    return pyramid
+
+def move_region(path : str, relocation : Relocation, compression : int = 2, level : int = None):
+    """Move every chunk of region file at <path> with <relocation>, compress them with codec <compression> at <level>
+    
+    Return a dict of moved (key, data, compression) chunks for each destination region coords.
+    Module-level so that regions can be sent to worker processes
+    """
+    sourceFile = McaFile.open(path)
+    routes = {}
     
-    xMax = (max(x) + 1) * McaFile.sideLength
-    xMin = min(x) * McaFile.sideLength
-    zMax = (max(z) + 1) * McaFile.sideLength
-    zMin = min(z) * McaFile.sideLength
+    for key in range(sourceFile.maxLength):
+        
+        data = sourceFile.load_data(key)
+        
+        if data is None:
+            continue
+        
+        chunk = relocation.chunk(McaFile.decode_chunk(*data))
+        
+        x, z = chunk.coords_chunk
+        xRegion, xChunk = divmod(x, McaFile.sideLength)
+        zRegion, zChunk = divmod(z, McaFile.sideLength)
+        
+        routes.setdefault((xRegion, zRegion), []).append((
+            McaFile.chunk_key(xChunk, zChunk),
+            compress(chunk.to_bytes(), compression, level),
+            compression
+        ))
     
-    return binaryMap, xMax, xMin, zMax, zMin
+    return routes
 
 def offset_conflicts(destination, source, offset):
-    """Check for conflicts if <source> was fused into <destination> at <offset>"""
+    """Check for conflicts if <source> was fused into <destination> at <offset>
     
-    # These variables are not stored in dicts on purpose !
-    # Dict access somehow halves performance
+    <destination>, <source> : Pyramids from map_and_boundaries, compared from their coarsest levels
+    """
     
     if destination is None or source is None:
         return False
     
-    aMap, aXmax, aXmin, aZmax, aZmin = destination
-    # Data from map_and_boundaries for destination
-    
-    bMap, bXmax, bXmin, bZmax, bZmin = source
-    # Data from map_and_boundaries for source
-    
     xOffset, zOffset = offset
-    # Offset coordinates
-    
-    sideLen = McaFile.sideLength
-    # Side length of a region file in chunks
+    xMin, xMax, zMin, zMax = source.bounds
     
-    defaultSearchMin = 0
-    defaultSearchMax = sideLen - 1
-    # Default search area limits inside a region file
-    
-    newXmax = bXmax + xOffset
-    newXmin = bXmin + xOffset
-    newZmax = bZmax + zOffset
-    newZmin = bZmin + zOffset
-    
-    for i in [newXmax, newXmin, newZmax, newZmin]:
+    for i in [xMin + xOffset, xMax + xOffset, zMin + zOffset, zMax + zOffset]:
         if i * 16 not in range(-Dimension.sideLength, Dimension.sideLength):
             return True
     # Cannot paste source outside of world border
     
-    overlapXmax = min(max(newXmax, aXmin), aXmax)
-    overlapXmin = min(max(newXmin, aXmin), aXmax)
-    overlapZmax = min(max(newZmax, aZmin), aZmax)
-    overlapZmin = min(max(newZmin, aZmin), aZmax)
-    
-    overlapXmaxRegion, overlapXmaxChunk = divmod(overlapXmax, sideLen)
-    overlapXminRegion, overlapXminChunk = divmod(overlapXmin, sideLen)
-    overlapZmaxRegion, overlapZmaxChunk = divmod(overlapZmax, sideLen)
-    overlapZminRegion, overlapZminChunk = divmod(overlapZmin, sideLen)
-    
-    # Check all chunks inside the overlapping area
-    conflict = False
-    for coords in aMap:
+    return destination.overlaps(source, offset)
+
+def write_region(path : str, chunks : list, keepExisting : bool = False):
+    """Save moved (key, data, compression) <chunks> to region file at <path>
     
-        xRegion, zRegion = coords
-        
-        if ( 
-                xRegion in range(overlapXminRegion, overlapXmaxRegion + 1)
-            and zRegion in range(overlapZminRegion, overlapZmaxRegion + 1)
-        ):
-            # If region is on the edge of the overlap, search only relevant chunks
-            searchXmax = overlapXmaxChunk if xRegion == overlapXmaxRegion else defaultSearchMax
-            searchXmin = overlapXminChunk if xRegion == overlapXminRegion else defaultSearchMin
-            searchZmax = overlapZmaxChunk if zRegion == overlapZmaxRegion else defaultSearchMax
-            searchZmin = overlapZminChunk if zRegion == overlapZminRegion else defaultSearchMin
-            
-            for z, row in enumerate(aMap[coords][searchZmin : searchZmax + 1]):
-                for x, chunkExists in enumerate(row[searchXmin : searchXmax + 1]):
-                
-                    if chunkExists:
-                        
-                        # Convert from search-relative to b-relative
-                        realX = x + searchXmin + xRegion*sideLen - xOffset
-                        realZ = z + searchZmin + zRegion*sideLen - zOffset
-                        
-                        # Convert to region and chunk
-                        realXregion, realXchunk = divmod(realX, sideLen)
-                        realZregion, realZchunk = divmod(realZ, sideLen)
-                        
-                        if (realXregion, realZregion) in bMap:
-                            conflict = bMap[realXregion, realZregion][realZchunk][realXchunk]
-                    
-                    if conflict:
-                        break
-                
-                if conflict:
-                    break
-        
-        if conflict:
-            break
-        
-    return conflict
\ No newline at end of file
+    <keepExisting> : Skip chunks which already exist, instead of failing.
+                     Used when resuming, as an interrupted fusion may have written some of them.
+    Module-level so that regions can be sent to worker processes
+    """
+    with McaFile.open(path) as f:
+        for key, data, compression in chunks:
+            if keepExisting and key in f:
+                continue
+            f.save_data(key, data, compression)
\ No newline at end of file
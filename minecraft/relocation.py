@@ -0,0 +1,377 @@
+from .chunk import Chunk
+from .world.dimension import Dimension
+import logging
+import random
+import struct
+
+class Relocation():
+    """Moves the NBT data of one dimension of a world by a fixed offset
+    
+    Holds no open file, so it can be sent to worker processes
+    """
+    
+    __slots__ = ['_blocks', 'dimension', 'mapDimensions', 'mapIdOffset', 'netherOffset']
+    
+    compiled = {}
+    """Result of compile for each (schema, ID)"""
+    
+    entities = {
+        '*' : {
+            'APX' : 'x',
+            'APZ' : 'z',
+            'ArmorItems' : 'items',
+            'Brain' : 'brain',
+            'HandItems' : 'items',
+            'Inventory' : 'items',
+            'Item' : 'item',
+            'Items' : 'items',
+            'Leash' : 'xz',
+            'Passengers' : 'entities',
+            'PatrolTarget' : 'xz',
+            'Pos' : 'pos',
+            'SleepingX' : 'x',
+            'SleepingZ' : 'z',
+            'TileEntityData' : 'tile_entity',
+            'TileX' : 'x',
+            'TileZ' : 'z',
+            'UUID' : 'uuid'
+        },
+        'minecraft:bee' : {
+            'FlowerPos' : 'xz',
+            'HivePos' : 'xz'
+        },
+        'minecraft:dolphin' : {
+            'TreasurePosX' : 'x',
+            'TreasurePosZ' : 'z'
+        },
+        'minecraft:end_crystal' : {
+            'BeamTarget' : 'xz'
+        },
+        'minecraft:phantom' : {
+            'AX' : 'x',
+            'AZ' : 'z'
+        },
+        'minecraft:turtle' : {
+            'HomePosX' : 'x',
+            'HomePosZ' : 'z',
+            'TravelPosX' : 'x',
+            'TravelPosZ' : 'z'
+        },
+        'minecraft:vex' : {
+            'BoundX' : 'x',
+            'BoundZ' : 'z'
+        },
+        'minecraft:wandering_trader' : {
+            'WanderTarget' : 'xz'
+        }
+    }
+    """Kind of coordinates held by NBT keys of entities with each ID, keys of '*' being in all of them
+    Each kind is moved by method move_<kind>. Supporting a new data version should only take editing this
+    """
+    
+    memories = {
+        'minecraft:home',
+        'minecraft:job_site',
+        'minecraft:meeting_point',
+        'minecraft:potential_job_site'
+    }
+    """Brain memories holding a position, along with the dimension it is in"""
+    
+    random = random.SystemRandom()
+    """Source of new UUIDs. Worker processes share the parent's random state, but not this one's"""
+    
+    scales = {'minecraft:overworld' : 8, 'minecraft:the_nether' : 1}
+    """Offset of each transferable dimension, in nether offsets. Other dimensions are not moved"""
+    
+    tileEntities = {
+        '*' : {
+            'Items' : 'items',
+            'x' : 'x',
+            'z' : 'z'
+        },
+        'minecraft:bee_nest' : {
+            'FlowerPos' : 'xz'
+        },
+        'minecraft:beehive' : {
+            'FlowerPos' : 'xz'
+        },
+        'minecraft:end_gateway' : {
+            'ExitPortal' : 'xz'
+        }
+    }
+    """Same as <entities>, for tile entities"""
+    
+    def __init__(self,
+        netherOffset : tuple,
+        mapIdOffset : int = 0,
+        mapDimensions : dict = None,
+        dimension : str = 'minecraft:overworld'
+    ):
+        
+        self.netherOffset = tuple(netherOffset)
+        """(x, z) chunk offset of the nether. The overworld is moved 8x as far to keep the portals connected"""
+        
+        self.mapIdOffset = mapIdOffset
+        """Added to the ID of every map item"""
+        
+        self.mapDimensions = mapDimensions or {}
+        """Dimension string ID of every map of the moved world, by map ID, see MapManager.dimensions"""
+        
+        self.dimension = dimension
+        """Dimension of the moved data"""
+        
+        self._blocks = self.blocks()
+        """Cached result of self.blocks(), used for every single coordinate"""
+    
+    def __repr__(self):
+        return f'Relocation of {self.dimension} by {self.chunks()} chunks'
+    
+    def blocks(self, dimension : str = None):
+        """Return (x, z) block offset of <dimension>, defaults to self.dimension"""
+        return tuple(i * 16 for i in self.chunks(dimension))
+    
+    def chunk(self, chunk):
+        """Move <chunk> and everything inside of it, return it"""
+        
+        xBlock, zBlock = self.blocks()
+        xChunk, zChunk = self.chunks()
+        
+        def update_BB(BB):
+            """Move bounding box of a Start or a Child in place
+            
+            Display an info message if a corrupted bounding box is found
+            """
+            if max(BB.values) > Dimension.sideLength:
+                x = chunk['']['Level']['xPos'] - xChunk
+                z = chunk['']['Level']['zPos'] - zChunk
+                logging.warning(
+                    f'Transferring possibly corrupted structure bounding-box in chunk {x} {z} as-is'
+                )
+            else:
+                self.move_box(BB)
+        
+        chunk['']['Level']['xPos'].value += xChunk
+        chunk['']['Level']['zPos'].value += zChunk
+        
+        if 'Entities' in chunk['']['Level']:
+            self.move_entities(chunk['']['Level']['Entities'])
+        
+        if 'TileEntities' in chunk['']['Level']:
+            for tile in chunk['']['Level']['TileEntities']:
+                self.tile_entity(tile)
+        
+        for key in ['LiquidTicks', 'TileTicks']:
+            if key in chunk['']['Level']:
+                for tick in chunk['']['Level'][key]:
+                    tick['x'].value += xBlock
+                    tick['z'].value += zBlock
+        
+        if 'Structures' in chunk['']['Level']:
+            
+            if 'References' in chunk['']['Level']['Structures']:
+                for reference in chunk['']['Level']['Structures']['References'].values():
+                    self.move_references(reference)
+            
+            if 'Starts' in chunk['']['Level']['Structures']:
+                for start in chunk['']['Level']['Structures']['Starts'].values():
+                    if start['id'] != 'INVALID':
+                        
+                        if 'BB' in start:
+                            update_BB(start['BB'])
+                        
+                        if 'ChunkX' in start:
+                            start['ChunkX'].value += xChunk
+                        
+                        if 'ChunkZ' in start:
+                            start['ChunkZ'].value += zChunk
+                        
+                        if 'Children' in start:
+                            for child in start['Children']:
+                                
+                                update_BB(child['BB'])
+                                
+                                for key in child:
+                                    if key == 'Entrances':
+                                        for entrance in child['Entrances']:
+                                            self.move_box(entrance)
+                                    
+                                    elif key == 'junctions':
+                                        for junction in child['junctions']:
+                                            junction['source_x'].value += xBlock
+                                            junction['source_z'].value += zBlock
+                                    
+                                    elif key in ['PosX', 'TPX']:
+                                        child[key].value += xBlock
+                                    
+                                    elif key in ['PosZ', 'TPZ']:
+                                        child[key].value += zBlock
+                        
+                        if 'Processed' in start:
+                            for process in start['Processed']:
+                                process['X'].value += xChunk
+                                process['Z'].value += zChunk
+        
+        return chunk
+    
+    def chunks(self, dimension : str = None):
+        """Return (x, z) chunk offset of <dimension>, defaults to self.dimension"""
+        scale = self.scales.get(dimension or self.dimension, 0)
+        return tuple(i * scale for i in self.netherOffset)
+    
+    @classmethod
+    def compile(cls, schema : str, ID : str):
+        """Return a dict of the method moving each key of compounds with <ID>, from schema <schema>
+        
+        <schema> : Name of a class attribute, either 'entities' or 'tileEntities'
+        Compiled once per ID and cached in <compiled>
+        """
+        if (schema, ID) not in cls.compiled:
+            table = getattr(cls, schema)
+            kinds = {**table['*'], **table.get(ID, {})}
+            cls.compiled[schema, ID] = {key : getattr(cls, f'move_{kind}') for key, kind in kinds.items()}
+        
+        return cls.compiled[schema, ID]
+    
+    def entity(self, entity):
+        """Move <entity> and its passengers in place, return it"""
+        rules = self.compile('entities', str(entity['id']) if 'id' in entity else None)
+        
+        for key in entity:
+            if key in rules:
+                rules[key](self, entity[key])
+        
+        return entity
+    
+    def for_dimension(self, dimension : str):
+        """Return a copy of this Relocation moving data of <dimension>"""
+        return type(self)(
+            netherOffset = self.netherOffset,
+            mapIdOffset = self.mapIdOffset,
+            mapDimensions = self.mapDimensions,
+            dimension = dimension
+        )
+    
+    def map_item(self, item):
+        """Update a map item's contained positional data in place, return it"""
+        mapDimension = self.mapDimensions.get(int(item['tag']['map']))
+        # Decorations of maps with no file cannot be moved, as their dimension is unknown
+        
+        if 'Decorations' in item['tag'] and mapDimension is not None:
+            
+            xMap, zMap = self.blocks(mapDimension)
+            
+            for decoration in item['tag']['Decorations']:
+                decoration['x'].value += xMap
+                decoration['z'].value += zMap
+        
+        item['tag']['map'].value += self.mapIdOffset
+        return item
+    
+    def move_box(self, box):
+        """Move Int_Array bounding box [xMin, yMin, zMin, xMax, yMax, zMax] <box> in place"""
+        xBlock, zBlock = self._blocks
+        xMin, yMin, zMin, xMax, yMax, zMax = box.values
+        box.values = [xMin + xBlock, yMin, zMin + zBlock, xMax + xBlock, yMax, zMax + zBlock]
+    
+    def move_brain(self, brain):
+        """Move positions remembered by <brain>, in the dimension they were remembered in"""
+        for key, memory in brain['memories'].items():
+            if key in self.memories:
+                
+                memoryDimension = str(memory['value']['dimension'])
+                
+                if memoryDimension in self.scales:
+                    xMemory, zMemory = self.blocks(memoryDimension)
+                    memory['value']['pos'][0].value += xMemory
+                    memory['value']['pos'][2].value += zMemory
+    
+    def move_entities(self, entities):
+        """Move every entity of list <entities>"""
+        for entity in entities:
+            self.entity(entity)
+    
+    def move_item(self, item):
+        """Move <item> if it is a filled map"""
+        if 'id' in item and item['id'] == 'minecraft:filled_map':
+            self.map_item(item)
+    
+    def move_items(self, items):
+        """Move every filled map of list <items>"""
+        for item in items:
+            self.move_item(item)
+    
+    def move_pos(self, pos):
+        """Move a [x, y, z] list of coords"""
+        pos[0].value += self._blocks[0]
+        pos[2].value += self._blocks[1]
+    
+    def move_references(self, references):
+        """Move every packed chunk coords of Long_Array <references> at once
+        
+        Each Long holds z in its high 32 bits and x in its low 32 bits,
+        so packing Longs big-endian and unpacking them as Ints gives z, x, z, x...
+        """
+        count = len(references)
+        
+        if count == 0:
+            return
+        
+        xChunk, zChunk = self.chunks()
+        coords = list(struct.unpack(f'>{2 * count}i', struct.pack(f'>{count}q', *references.values)))
+        coords[0::2] = [z + zChunk for z in coords[0::2]]
+        coords[1::2] = [x + xChunk for x in coords[1::2]]
+        references.values = struct.unpack(f'>{count}q', struct.pack(f'>{2 * count}i', *coords))
+    
+    def move_tile_entity(self, tile):
+        """Move compound <tile>, see tile_entity"""
+        self.tile_entity(tile)
+    
+    def move_uuid(self, UUID):
+        """Replace every Int of <UUID> with a random one, so that moved entities are new ones"""
+        for i in UUID:
+            i.value = self.random.randint(-2_147_483_648, 2_147_483_647)
+    
+    def move_x(self, x):
+        """Move a lone x coord"""
+        x.value += self._blocks[0]
+    
+    def move_xz(self, compound):
+        """Move a compound of X, Y and Z coords"""
+        if 'X' in compound:
+            compound['X'].value += self._blocks[0]
+        if 'Z' in compound:
+            compound['Z'].value += self._blocks[1]
+    
+    def move_z(self, z):
+        """Move a lone z coord"""
+        z.value += self._blocks[1]
+    
+    def tile_entity(self, tile):
+        """Move <tile> entity in place, return it"""
+        rules = self.compile('tileEntities', str(tile['id']) if 'id' in tile else None)
+        
+        for key in tile:
+            if key in rules:
+                rules[key](self, tile[key])
+        
+        return tile
+
+def relocate_chunk(
+    data,
+    netherOffset : tuple,
+    mapDimensions : dict = None,
+    dimension : str = 'minecraft:overworld',
+    mapIdOffset : int = 0
+):
+    """Return uncompressed NBT data of chunk <data> moved by <netherOffset>, see Relocation for other arguments
+    
+    Takes and returns bytes, and all arguments are plain picklable values,
+    so that it can run in any worker process with nothing but this module imported
+    """
+    relocation = Relocation(
+        netherOffset = netherOffset,
+        mapIdOffset = mapIdOffset,
+        mapDimensions = mapDimensions,
+        dimension = dimension
+    )
+    return relocation.chunk(Chunk.from_bytes(data)).to_bytes()
@@ -1,26 +1,48 @@
 from minecraft.chunk import Chunk
 from minecraft.mcafile import McaFile
-import concurrent.futures
+import contextlib
+import json
 import os
 import util
 
 class Dimension(util.Cache):
     """A dimension of a minecraft world"""
     
-    __slots__ : ['_cache', 'folder']
+    __slots__ : ['_cache', 'executor', 'folder', 'maxChunks']
+    
+    chunkBytes = 1 << 20
+    """Memory a loaded chunk is counted as by sizeof. A chunk with 16 full sections takes about 700 KB once decoded"""
+    
+    occupancyFileName = 'infinifuse_occupancy.json'
+    """Name of the file caching the result of occupancy() in each dimension folder"""
+    
+    pyramids = {}
+    """Cached util.Pyramid of each dimension folder, along with the region_stats it was made from"""
     
     sideLength = 60_002_304
     """Maximum side length of a dimension in blocks
     Defined so that range(-sideLength, sideLength) includes every legal block coordinate
     """
     
-    def __init__(self, folder : str):
+    def __init__(self, 
+        folder : str, 
+        executor : util.Executor = None,
+        maxSize : int = None,
+        maxBytes : int = None,
+        maxChunks : int = None
+    ):
     
         self.folder = folder
         """Folder containing this dimension's .mca files"""
     
-        self._cache = {}
-        """Cache containing loaded chunks"""
+        util.Cache.__init__(self, maxSize = maxSize, maxBytes = maxBytes)
+        """Cache containing loaded McaFiles, holding at most <maxSize> files or <maxBytes> bytes, see sizeof"""
+        
+        self.executor = executor or util.Executor.default()
+        """Executor shared with contained McaFiles"""
+        
+        self.maxChunks = maxChunks
+        """Maximum number of loaded chunks cached by each McaFile, or None for no limit"""
     
     def __contains__(self, key):
         """Returns whether chunk <key> exists in this dimension"""
@@ -76,12 +98,40 @@ class Dimension(util.Cache):
             self[xChunk, zChunk][x, y, z] = value
     
     def binary_map(self):
-        """Return a dict of the binary maps of all contained McaFiles, indexed by region coords"""
+        """Return a dict of the binary maps of all contained McaFiles, indexed by region coords
+        
+        Same as McaFile.binary_map, but from occupancy() so that files are not read again
+        """
+        length = McaFile.sideLength
         binMap = {}
-        for f in self.files():
-            binMap[f.coords_region] = f.binary_map()
+        for key, occupancy in self.occupancy().items():
+            binMap[key] = [[bool(occupancy >> McaFile.chunk_key(x, z) & 1) for x in range(length)] for z in range(length)]
         return binMap
     
+    def bitmap(self):
+        """Return a util.Bitmap of all contained chunks, in dimension-wide chunk coords"""
+        occupancies = self.occupancy()
+        
+        if occupancies == {}:
+            return util.Bitmap()
+        
+        sideLength = McaFile.sideLength
+        xOrigin = min([xRegion for xRegion, _ in occupancies]) * sideLength
+        zOrigin = min([zRegion for _, zRegion in occupancies]) * sideLength
+        zEnd = (max([zRegion for _, zRegion in occupancies]) + 1) * sideLength
+        
+        rows = [0] * (zEnd - zOrigin)
+        rowMask = (1 << sideLength) - 1
+        
+        for (xRegion, zRegion), occupancy in occupancies.items():
+            shift = xRegion * sideLength - xOrigin
+            for z in range(sideLength):
+                # Keys of a row of chunks are consecutive, see McaFile.chunk_key
+                bits = occupancy >> (z * sideLength) & rowMask
+                rows[zRegion * sideLength + z - zOrigin] |= bits << shift
+        
+        return util.Bitmap(x = xOrigin, z = zOrigin, rows = rows)
+    
     def convert_key(self, key):
         """Convert <key> to a tuple of ints"""
         key = tuple([int(i) for i in key])
@@ -95,17 +145,52 @@ class Dimension(util.Cache):
     
     def files(self):
         """Generate a list of contained .mca files files"""
-        if os.path.exists(self.folder):
-            for f in os.listdir(self.folder):
-                if os.path.splitext(f)[1] == '.mca':
-                    yield McaFile.open(os.path.join(self.folder, f))
-        else:
-            return []
+        for key in self.regions():
+            yield McaFile.open(self.region_path(key), executor = self.executor, maxSize = self.maxChunks)
+    
+    def is_dirty(self, key, value):
+        """Whether McaFile <value> has changes to write"""
+        return value.modified
     
     def load_value(self, key):
         """Return McaFile at coords in key"""
-        xRegion, zRegion = key
-        return McaFile.open(path = os.path.join(self.folder, f'r.{xRegion}.{zRegion}.mca'))
+        return McaFile.open(path = self.region_path(key), executor = self.executor, maxSize = self.maxChunks)
+    
+    def occupancy(self):
+        """Return a dict of which chunks exist in each contained McaFile, see McaFile.read_occupancy
+        
+        Results are kept in <occupancyFileName> with the size and modification time of each file,
+        so that only files which changed since are read again, and only their headers
+        """
+        path = os.path.join(self.folder, self.occupancyFileName)
+        stats = self.region_stats()
+        
+        index = {}
+        try:
+            with open(path, mode = 'r') as f:
+                for xRegion, zRegion, size, mtime, occupancy in json.load(f):
+                    index[xRegion, zRegion] = ((size, mtime), int(occupancy, 16))
+        except (OSError, TypeError, ValueError):
+            # Missing or unreadable, start from scratch
+            index = {}
+        
+        occupancies = {}
+        for key, stat in stats.items():
+            if key in index and index[key][0] == stat:
+                occupancies[key] = index[key][1]
+            else:
+                occupancies[key] = McaFile.read_occupancy(self.region_path(key))
+        
+        if index.keys() != stats.keys() or any([index[key][0] != stats[key] for key in stats]):
+            # A world which cannot be written to can still be mapped, just not faster next time
+            with contextlib.suppress(OSError):
+                with util.atomic_write(path, mode = 'w') as f:
+                    json.dump(
+                        [[*key, *stats[key], f'{occupancy:x}'] for key, occupancy in occupancies.items()],
+                        f
+                    )
+        
+        return occupancies
     
     def png_map(self, size : int = 0, shade : int = 127):
         """Return a PNG map of chunk locations
@@ -114,13 +199,14 @@ class Dimension(util.Cache):
         <shade> : 0 - 255 shade of grey for existing pixels, defaults to 127
         """
         limit = size // 64
+        binMap = self.binary_map()
+        emptyMap = [[False] * McaFile.sideLength] * McaFile.sideLength
         regionPNGs = {}
         
         for z in range(-limit, limit):
             regionPNGs[z] = {}
             for x in range(-limit, limit):
-                f = util.Cache.__getitem__(self, key = (x, z))
-                regionPNGs[z][x] = util.PNG.from_iterable(f.binary_map(), shade = shade)
+                regionPNGs[z][x] = util.PNG.from_iterable(binMap.get((x, z), emptyMap), shade = shade)
         
         data = bytearray()
         for z in regionPNGs:
@@ -138,16 +224,53 @@ class Dimension(util.Cache):
             interlaced = False
         )
     
+    def pyramid(self):
+        """Return a util.Pyramid of all contained chunks, made once for as long as no region file changes"""
+        stats = self.region_stats()
+        folder = os.path.abspath(self.folder)
+        
+        if folder not in self.pyramids or self.pyramids[folder][0] != stats:
+            self.pyramids[folder] = (stats, util.Pyramid(self.bitmap()))
+        
+        return self.pyramids[folder][1]
+    
+    def region_path(self, key):
+        """Return path of the .mca file at region coords in <key>"""
+        xRegion, zRegion = key
+        return os.path.join(self.folder, f'r.{xRegion}.{zRegion}.mca')
+    
+    def regions(self):
+        """Generate region coords of all contained .mca files, without opening them"""
+        if os.path.exists(self.folder):
+            for f in os.listdir(self.folder):
+                if os.path.splitext(f)[1] == '.mca':
+                    _, xRegion, zRegion, _ = f.split('.')
+                    yield int(xRegion), int(zRegion)
+    
+    def region_stats(self):
+        """Return a dict of (size, modification time) of all contained .mca files, indexed by region coords"""
+        stats = {}
+        if os.path.exists(self.folder):
+            for entry in os.scandir(self.folder):
+                if os.path.splitext(entry.name)[1] == '.mca':
+                    _, xRegion, zRegion, _ = entry.name.split('.')
+                    stat = entry.stat()
+                    stats[int(xRegion), int(zRegion)] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+    
     def save_all(self):
         """Save all McaFiles from cache"""
-        with concurrent.futures.ProcessPoolExecutor() as e:
-            # ProcessPool seems to be slightly faster than ThreadPool here
-            for _ in e.map(McaFile.write, self._cache.values()):
-                pass
+        # A process pool seems to be slightly faster than a thread pool here
+        files = [value for key, value in self._cache.items() if self.needs_save(key, value)]
+        for _ in self.executor.map(McaFile.write, files):
+            pass
         self.discard_all()
     
     def save_value(self, key, value):
         """Write <value> to McaFile at coords in <key>"""
-        xRegion, zRegion = key
-        value.path = os.path.join(self.folder, f'r.{xRegion}.{zRegion}.mca')
-        value.write()
\ No newline at end of file
+        value.path = self.region_path(key)
+        value.write()
+    
+    def sizeof(self, value):
+        """Size of the data held by McaFile <value>, in bytes, each of its loaded chunks counting as <chunkBytes>"""
+        return len(value.value) + len(value._cache) * self.chunkBytes
\ No newline at end of file
@@ -1,12 +1,60 @@
 from minecraft.datfile import DatFile
+import itertools
 import minecraft.TAG as TAG
 import os
+import util
 
 class MapManager():
-    """Manages all the map files in a folder"""
+    """Manages all the map files in a folder
+    
+    Use as a context manager to keep idcounts in memory and only write it once, at the end of the with block
+    """
+    
+    dimensionNames = {
+        -1 : 'minecraft:the_nether',
+         0 : 'minecraft:overworld',
+         1 : 'minecraft:the_end'
+    }
+    """String ID of each dimension, for maps made before dimensions were stored as strings"""
+    
+    threads = util.Executor(kind = 'thread')
+    """Threads reading and writing map files, overlapping the fsync util.atomic_write does for each small map file"""
     
     def __init__(self, folder : str):
+        
         self.folder = folder
+        """Folder containing map files"""
+        
+        self._dimensions = None
+        """Cached result of dimensions(), or None until it is known"""
+        
+        self._depth = 0
+        """Number of with blocks this is inside of"""
+        
+        self._idcounts = None
+        """idcounts kept in memory inside of with blocks, None outside of them"""
+        
+        self._idcountsChanged = False
+        """Whether idcounts changed since the start of the outermost with block"""
+    
+    def __enter__(self):
+        """Read idcounts once, return self"""
+        if self._depth == 0:
+            self._idcounts = self.idcounts
+            self._idcountsChanged = False
+        self._depth += 1
+        return self
+    
+    def __exit__(self, exc_type = None, exc_value = None, traceback = None):
+        """Write idcounts if it changed, when leaving the outermost with block without an exception
+        
+        Maps are written before idcounts is, so an interrupted block leaves no reserved ID without a map
+        """
+        self._depth -= 1
+        if self._depth == 0:
+            value, self._idcounts = self._idcounts, None
+            if exc_type is None and self._idcountsChanged:
+                self.idcounts = value
     
     def __len__(self):
         return self.idcounts + 1
@@ -29,11 +77,13 @@ class MapManager():
         path = os.path.join(self.folder, f'map_{key}.dat')
         with DatFile(path) as f:
             f.value = value
+        
+        if self._dimensions is not None:
+            self._dimensions[key] = self.dimension_name(value['']['data']['dimension'])
     
     def append(self, value):
         """Add a map to this world"""
-        self.idcounts += 1
-        self[self.idcounts] = value
+        self.extend([value])
 
     def convert_key(self, key):
         key = int(key)
@@ -43,9 +93,39 @@ class MapManager():
         
         return key
 
+    @classmethod
+    def dimension_name(cls, dimension):
+        """Return string ID of map dimension <dimension>, converting it first if it is a number"""
+        if isinstance(dimension, (int, TAG.Integer)):
+            return cls.dimensionNames.get(int(dimension), str(int(dimension)))
+        return str(dimension)
+    
+    def dimensions(self):
+        """Return a dict of the dimension string ID of every map, by map ID
+        
+        Maps are only read the first time, and the result kept up to date as maps are set
+        """
+        if self._dimensions is None:
+            for _ in self.items():
+                pass
+        return self._dimensions
+    
+    def extend(self, maps):
+        """Add every map of iterable <maps> to this world, several files at once"""
+        maps = list(maps)
+        
+        with self:
+            first = self.idcounts + 1
+            self.idcounts += len(maps)
+            self.write_all(zip(itertools.count(first), maps))
+    
     @property
     def idcounts(self):
         """Biggest used map ID, as stored in idcounts.dat"""
+        
+        if self._idcounts is not None:
+            return self._idcounts
+        
         path = os.path.join(self.folder, 'idcounts.dat')
         
         with DatFile(path) as f:
@@ -63,6 +143,11 @@ class MapManager():
         if value < 0:
             raise ValueError('idcounts must be at least 0 !')
         
+        if self._idcounts is not None:
+            self._idcounts = value
+            self._idcountsChanged = True
+            return
+        
         path = os.path.join(self.folder, 'idcounts.dat')
         
         with DatFile(path) as f:
@@ -81,4 +166,36 @@ class MapManager():
                 f['']['data']['map'] = value
                 
             else:
-                f['']['map'] = value
\ No newline at end of file
+                f['']['map'] = value
+    
+    def items(self):
+        """Generate (map ID, map) of every contained map, reading several files at once
+        
+        Missing map files are skipped. Also fills the cache of dimensions() if it is empty
+        """
+        dimensions = {}
+        keys = range(len(self))
+        
+        for key, value in zip(keys, self.threads.map(self.read, keys, chunksize = 16)):
+            if value is not None:
+                dimensions[key] = self.dimension_name(value['']['data']['dimension'])
+                yield key, value
+        
+        if self._dimensions is None:
+            self._dimensions = dimensions
+    
+    def read(self, key):
+        """Return map number <key>, or None if its file does not exist"""
+        path = os.path.join(self.folder, f'map_{key}.dat')
+        
+        if not os.path.exists(path):
+            return None
+        
+        with DatFile(path) as f:
+            return TAG.Compound(f)
+    
+    def write_all(self, items):
+        """Write every (map ID, map) of iterable <items>, several files at once"""
+        with self:
+            for _ in self.threads.map(lambda item : self.__setitem__(*item), items, chunksize = 16):
+                pass
\ No newline at end of file
@@ -4,10 +4,55 @@ import json
 import logging
 import minecraft.TAG as TAG
 import os
+import util
+
+class Player(dict):
+    """Data of a player, as returned by PlayerManager
+    
+    'advancements' and 'stats' are only read from their JSON files once they are accessed.
+    Until then, PlayerManager copies those files as-is when this player is written.
+    """
+    
+    __slots__ = ['folder', 'uuid']
+    
+    def __init__(self, folder : str, uuid : str, *args, **kwargs):
+        
+        super().__init__(*args, **kwargs)
+        
+        self.folder = folder
+        """Folder of the world this player was read from"""
+        
+        self.uuid = uuid
+        """Hyphenated-hexadecimal UUID of this player"""
+    
+    def __missing__(self, key):
+        """Read JSON file <key> the first time it is accessed"""
+        
+        if key not in PlayerManager.jsonFolders:
+            raise KeyError(key)
+        
+        path = self.json_path(key)
+        if os.path.exists(path):
+            with open(path, mode = 'r') as f:
+                self[key] = json.load(f)
+        else:
+            self[key] = {}
+        
+        return self[key]
+    
+    def json_path(self, subfolder : str):
+        """Return path of the JSON file of this player in <subfolder>"""
+        return os.path.join(self.folder, subfolder, f'{self.uuid}.json')
 
 class PlayerManager(MutableMapping):
     """Handles accessing and modifying player data and stats"""
     
+    jsonFolders = ['advancements', 'stats']
+    """Subfolders of a world holding a JSON file per player"""
+    
+    threads = util.Executor(kind = 'thread')
+    """Threads reading and writing player files, overlapping the copies of each player's several small files"""
+    
     def __init__(self, folder : str):
         self.folder = folder
     
@@ -23,28 +68,24 @@ class PlayerManager(MutableMapping):
         if os.path.exists(path):
             os.remove(path)
         
-        for subfolder in ['advancements', 'stats']:
+        for subfolder in self.jsonFolders:
             path = os.path.join(self.folder, subfolder, f'{uuid}.json')
             if os.path.exists(path):
                 os.remove(path)
     
     def __iter__(self):
-        """Return all contained player UUIDs"""
+        """Return all contained player UUIDs, from a single scan of the playerdata folder"""
         path = os.path.join(self.folder, 'playerdata')
         
         if os.path.exists(path):
-            for name in os.listdir(path):
-                basename = os.path.basename(name)
-                uuid, ext = os.path.splitext(basename)
-                if ext == '.dat':
-                    yield uuid
-                else:
-                    continue
-        else:
-            return None
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    uuid, ext = os.path.splitext(entry.name)
+                    if ext == '.dat':
+                        yield uuid
     
     def __getitem__(self, uuid):
-        """Return player <uuid>'s data
+        """Return player <uuid>'s data, as a Player
         
         <uuid> : A hyphenated-hexadecinal Minecraft Player UUID
         """
@@ -52,35 +93,17 @@ class PlayerManager(MutableMapping):
         if uuid not in self:
             raise KeyError(f'Player {uuid} has no playerdata')
         
-        player = {}
+        player = Player(folder = self.folder, uuid = uuid)
         
         path = os.path.join(self.folder, 'playerdata', f'{uuid}.dat')
         with DatFile(path) as f:
             player['playerdata'] = TAG.Compound(f)
         
-        for subfolder in ['advancements', 'stats']:
-            path = os.path.join(self.folder, subfolder, f'{uuid}.json')
-            if os.path.exists(path):
-                with open(path, mode = 'r') as f:
-                    player[subfolder] = json.load(f)
-            else:
-                player[subfolder] = {}
-        
         return player
     
     def __len__(self):
         """How many players are contained"""
-        count = 0
-        path = os.path.join(self.folder, 'playerdata')
-        
-        if os.path.exists(path):
-            for name in os.listdir(path):
-                basename = os.path.basename(name)
-                uuid, ext = os.path.splitext(basename)
-                if ext == '.dat':
-                    count += 1
-        
-        return count
+        return sum([1 for _ in self])
     
     def  __setitem__(self, uuid, player):
         """Write data for player <uuid>
@@ -94,11 +117,26 @@ class PlayerManager(MutableMapping):
             with DatFile(path) as f:
                 f.value = player['playerdata']
         
-        for subfolder in ['advancements', 'stats']:
+        for subfolder in self.jsonFolders:
+            path = os.path.join(self.folder, subfolder, f'{uuid}.json')
+            
             if subfolder in player:
-                path = os.path.join(self.folder, subfolder, f'{uuid}.json')
-                with open(path, mode = 'w') as f:
+                with util.atomic_write(path, mode = 'w') as f:
                     json.dump(player[subfolder], f)
+            
+            elif isinstance(player, Player) and os.path.exists(player.json_path(subfolder)):
+                # Never read, so copied byte for byte
+                with open(player.json_path(subfolder), mode = 'rb') as source:
+                    with util.atomic_write(path) as f:
+                        f.write(source.read())
+    
+    def items(self, uuids = None):
+        """Generate (uuid, Player) of every player in <uuids>, reading several .dat files at once
+        
+        <uuids> : Iterable of player UUIDs, defaults to every contained player
+        """
+        uuids = list(self if uuids is None else uuids)
+        yield from zip(uuids, self.threads.map(self.__getitem__, uuids, chunksize = 16))
     
     def setup_conversion(self, target_uuid : str, replacement_uuid : str):
         """Rename all files of player <target_uuid> to <replacement_uuid>
@@ -109,5 +147,8 @@ class PlayerManager(MutableMapping):
         """
         temp_folder = os.path.join(os.environ['temp'], 'InfiniFuse')
         os.mkdir(temp_folder)
-        
-    
\ No newline at end of file
+    
+    def write_all(self, items):
+        """Write every (uuid, player) of iterable <items>, several at once. Generate uuids as they are written"""
+        for uuid, _ in self.threads.map(lambda item : (item[0], self.__setitem__(*item)), items, chunksize = 16):
+            yield uuid
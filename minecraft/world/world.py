@@ -3,30 +3,43 @@ from .mapmanager import MapManager
 from .playermanager import PlayerManager
 import logging
 import os
+import util
 
 class World():
     """Interface for minecraft worlds"""
     
-    __slots__ = ['folder', 'dimensions', 'maps', 'players']
+    __slots__ = ['executor', 'folder', 'dimensions', 'maps', 'players']
     
-    def __init__(self, folder : str):
+    def __init__(self, folder : str, executor : util.Executor = None):
         
         self.folder = folder
         """Folder containing the world files"""
         
+        self.executor = executor or util.Executor.default()
+        """Executor shared by all dimensions of this world"""
+        
         self.dimensions = {}
-        self.dimensions['minecraft:overworld'] = Dimension(os.path.join(folder, 'region'))
-        self.dimensions['minecraft:the_end'] = Dimension(os.path.join(folder, 'DIM1','region'))
-        self.dimensions['minecraft:the_nether'] = Dimension(os.path.join(folder, 'DIM-1', 'region'))
+        self.dimensions['minecraft:overworld'] = Dimension(
+            os.path.join(folder, 'region'), 
+            executor = self.executor
+        )
+        self.dimensions['minecraft:the_end'] = Dimension(
+            os.path.join(folder, 'DIM1','region'), 
+            executor = self.executor
+        )
+        self.dimensions['minecraft:the_nether'] = Dimension(
+            os.path.join(folder, 'DIM-1', 'region'), 
+            executor = self.executor
+        )
         self.maps = MapManager(folder = os.path.join(self.folder, 'data'))
         self.players = PlayerManager(folder = self.folder)
     
     @classmethod
-    def from_saves(cls, name : str):
+    def from_saves(cls, name : str, executor : util.Executor = None):
         """Open a world from name of save folder"""
         appdata = os.environ['appdata']
         folder = os.path.join(appdata, '.minecraft', 'saves', name)
-        return cls(folder)
+        return cls(folder, executor = executor)
     
     def png_maps(self, folder : str = None, size : int = 256, skipEnd : bool = False):
         """Make PNG maps of all dimensions of this world. Each pixel will represent a chunk.
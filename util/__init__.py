@@ -1,5 +1,9 @@
 from .all_subclasses import all_subclasses
 from .binary import bitstr, read_bytes, get_bits, set_bits
+from .bitmap import Bitmap, Pyramid
 from .cache import Cache
+from .executor import Executor
+from .files import atomic_write, Journal
+from .instrumentation import Histogram, measure, Metrics, metrics, Span
 from .make_wrappers import make_wrappers
 from .png import makePNG, PNG
\ No newline at end of file
@@ -0,0 +1,284 @@
+class Bitmap():
+    """A 2D grid of booleans, packed into one int per row
+    
+    Bit n of row m is the cell at (self.x + n, self.z + m).
+    Bitmaps are compared a whole row at a time, with a single AND per row.
+    """
+    
+    __slots__ = ['_bounds', 'rows', 'x', 'z']
+    
+    def __init__(self, x : int = 0, z : int = 0, rows : list = None):
+        
+        self._bounds = None
+        """Cached result of self.bounds, which can be slow to compute"""
+        
+        self.rows = rows or []
+        """One int per row, bit n being the cell at self.x + n. Only change through __setitem__"""
+        
+        self.x = x
+        """x coordinate of bit 0 of every row"""
+        
+        self.z = z
+        """z coordinate of the first row"""
+    
+    def __getitem__(self, key):
+        """Whether cell at (x, z) <key> is set"""
+        x, z = key
+        x -= self.x
+        z -= self.z
+        return x >= 0 and z in range(len(self.rows)) and bool(self.rows[z] >> x & 1)
+    
+    def __or__(self, other):
+        """Return a Bitmap of cells set in self or <other>"""
+        
+        if other.rows == []:
+            return Bitmap(x = self.x, z = self.z, rows = list(self.rows))
+        elif self.rows == []:
+            return Bitmap(x = other.x, z = other.z, rows = list(other.rows))
+        
+        x = min(self.x, other.x)
+        z = min(self.z, other.z)
+        rows = [0] * (max(self.z + len(self.rows), other.z + len(other.rows)) - z)
+        
+        for bitmap in [self, other]:
+            for i, row in enumerate(bitmap.rows):
+                rows[bitmap.z + i - z] |= row << (bitmap.x - x)
+        
+        return Bitmap(x = x, z = z, rows = rows)
+    
+    def __len__(self):
+        """Number of set cells"""
+        return sum([row.bit_count() for row in self.rows])
+    
+    def __repr__(self):
+        return f'Bitmap of {len(self)} cells, bounds {self.bounds}'
+    
+    def __setitem__(self, key, value):
+        """Set or clear cell at (x, z) <key>, growing this bitmap if needed"""
+        x, z = key
+        self._bounds = None
+        
+        if x < self.x:
+            self.rows = [row << (self.x - x) for row in self.rows]
+            self.x = x
+        
+        if self.rows == []:
+            self.z = z
+        
+        if z < self.z:
+            self.rows = [0] * (self.z - z) + self.rows
+            self.z = z
+        
+        if z >= self.z + len(self.rows):
+            self.rows += [0] * (z - self.z - len(self.rows) + 1)
+        
+        if value:
+            self.rows[z - self.z] |= 1 << (x - self.x)
+        else:
+            self.rows[z - self.z] &= ~(1 << (x - self.x))
+    
+    @property
+    def bounds(self):
+        """(xMin, xMax, zMin, zMax) of set cells, maximums excluded, or None if there are none"""
+        
+        if self._bounds is None:
+            
+            filled = [i for i, row in enumerate(self.rows) if row]
+            
+            if filled == []:
+                return None
+            
+            xMin = min([(row & -row).bit_length() - 1 for row in self.rows if row])
+            xMax = max([row.bit_length() for row in self.rows])
+            
+            self._bounds = (self.x + xMin, self.x + xMax, self.z + filled[0], self.z + filled[-1] + 1)
+        
+        return self._bounds
+    
+    def cells(self, xMin : int, width : int):
+        """Return a list of one bytes object per row, with one 0 or 1 byte per cell from x <xMin> to <xMin> + <width>"""
+        table = bytes.maketrans(b'01', b'\x00\x01')
+        cells = []
+        
+        for row in self.rows:
+            row = row >> (xMin - self.x) if xMin >= self.x else row << (self.x - xMin)
+            bits = bin(row & ((1 << width) - 1))[2:].zfill(width)
+            cells.append(bits[::-1].encode().translate(table))
+        
+        return cells
+    
+    def dilate(self):
+        """Return a Bitmap where every set cell also sets its +x, +z and +x +z neighbours"""
+        rows = [row | row << 1 for row in self.rows] + [0]
+        
+        for i in range(len(rows) - 1, 0, -1):
+            rows[i] |= rows[i - 1]
+        
+        return Bitmap(x = self.x, z = self.z, rows = rows)
+    
+    def downsample(self, factor : int):
+        """Return a Bitmap with one cell per <factor> x <factor> square of cells, set if any of them is
+        
+        Squares are aligned on multiples of <factor>, so that cell (x, z) becomes cell (x // factor, z // factor)
+        """
+        x = self.x // factor
+        z = self.z // factor
+        rows = [0] * ((self.z + len(self.rows) - 1) // factor - z + 1)
+        
+        for i, row in enumerate(self.rows):
+            rows[(self.z + i) // factor - z] |= row
+        
+        for i, row in enumerate(rows):
+            
+            # Smear every set bit down to the start of its square, then keep only the start of each square
+            row <<= self.x - x * factor
+            covered = 1
+            
+            while covered < factor:
+                shift = min(covered, factor - covered)
+                row |= row >> shift
+                covered += shift
+            
+            sampled = bin(row)[2:][::-1][::factor]
+            rows[i] = int(sampled[::-1], 2)
+        
+        return Bitmap(x = x, z = z, rows = rows)
+    
+    def overlap_offsets(self, other):
+        """Return a Bitmap of every (x, z) offset at which <other> overlaps self
+        
+        Overlap counts for all offsets are the coefficients of the product of two polynomials,
+        one per bitmap, the second one reversed. Both are packed into big ints with enough bits per
+        coefficient that they cannot carry into each other, so that a single multiplication does it all.
+        """
+        if self.bounds is None or other.bounds is None:
+            return Bitmap()
+        
+        axMin, axMax, azMin, azMax = self.bounds
+        bxMin, bxMax, bzMin, bzMax = other.bounds
+        
+        width = (axMax - axMin) + (bxMax - bxMin) - 1
+        height = (azMax - azMin) + (bzMax - bzMin) - 1
+        # Size of the grid of offsets, also used as row length of both polynomials
+        
+        coefficientLength = (min(len(self), len(other)).bit_length() + 7) // 8
+        # Bytes per coefficient, enough to hold the largest possible overlap count
+        
+        polynomials = []
+        for rows in [
+            self.cells(axMin, axMax - axMin)[azMin - self.z : azMax - self.z],
+            [row[::-1] for row in other.cells(bxMin, bxMax - bxMin)[bzMin - other.z : bzMax - other.z]][::-1]
+        ]:
+            cells = bytearray().join([row.ljust(width, b'\x00') for row in rows])
+            data = bytearray(len(cells) * coefficientLength)
+            data[::coefficientLength] = cells
+            polynomials.append(int.from_bytes(data, 'little'))
+        
+        product = polynomials[0] * polynomials[1]
+        product = product.to_bytes(width * height * coefficientLength, 'little')
+        
+        # Only whether each count is 0 matters
+        table = bytes.maketrans(bytes(range(256)), b'\x00' + b'\x01' * 255)
+        overlaps = int.from_bytes(product.translate(table), 'little')
+        for i in range(1, coefficientLength):
+            overlaps |= overlaps >> (8 * i)
+        overlaps = overlaps.to_bytes(len(product), 'little')[::coefficientLength]
+        
+        table = bytes.maketrans(b'\x00\x01', b'01')
+        rows = []
+        for i in range(height):
+            row = overlaps[i * width : (i + 1) * width].translate(table)
+            rows.append(int(row[::-1], 2))
+        
+        return Bitmap(x = axMin - bxMax + 1, z = azMin - bzMax + 1, rows = rows)
+    
+    def overlaps(self, other, offset : tuple = (0, 0)):
+        """Whether any cell is set both in self and in <other> moved by (x, z) <offset>"""
+        xOffset, zOffset = offset
+        shift = other.x + xOffset - self.x
+        
+        start = max(self.z, other.z + zOffset)
+        end = min(self.z + len(self.rows), other.z + zOffset + len(other.rows))
+        
+        for z in range(start, end):
+            
+            row = other.rows[z - other.z - zOffset]
+            row = row << shift if shift >= 0 else row >> -shift
+            
+            if row & self.rows[z - self.z]:
+                return True
+        
+        return False
+
+class Pyramid():
+    """The same Bitmap at several resolutions, so that overlaps can be ruled out on the coarsest ones first
+    
+    Level n has one cell per n x n square of cells of level 1, see Bitmap.downsample
+    """
+    
+    __slots__ = ['_dilated', 'levels']
+    
+    factors = [1, 4, 32, 256]
+    """Levels built upfront: chunks, 4 x 4 chunks, regions and 8 x 8 regions"""
+    
+    def __init__(self, bitmap : Bitmap, factors : list = None):
+        
+        self._dilated = {}
+        """Cached result of self.dilated for each level"""
+        
+        self.levels = {1 : bitmap}
+        """Bitmap of each level, by factor. Others are added as they are needed"""
+        
+        for factor in factors or self.factors:
+            self.level(factor)
+    
+    def __getitem__(self, key):
+        """Whether cell at (x, z) <key> is set in level 1"""
+        return self.levels[1][key]
+    
+    def __len__(self):
+        """Number of set cells in level 1"""
+        return len(self.levels[1])
+    
+    def __repr__(self):
+        return f'Pyramid of {len(self)} cells, levels {sorted(self.levels)}'
+    
+    @property
+    def bounds(self):
+        """Bounds of level 1, see Bitmap.bounds"""
+        return self.levels[1].bounds
+    
+    def dilated(self, factor : int):
+        """Return level <factor> dilated, see Bitmap.dilate"""
+        if factor not in self._dilated:
+            self._dilated[factor] = self.level(factor).dilate()
+        return self._dilated[factor]
+    
+    def level(self, factor : int):
+        """Return level <factor>, downsampling the closest finer level it is a multiple of if needed"""
+        if factor not in self.levels:
+            base = max([i for i in self.levels if factor % i == 0])
+            self.levels[factor] = self.levels[base].downsample(factor // base)
+        return self.levels[factor]
+    
+    def overlaps(self, other, offset : tuple = (0, 0)):
+        """Whether any cell is set both in self and in Pyramid <other> moved by (x, z) <offset>
+        
+        Every level of self and <other> is tried from the coarsest,
+        the first one without overlaps proving there are none at level 1 either
+        """
+        xOffset, zOffset = offset
+        
+        for factor in sorted(set(self.levels) & set(other.levels), reverse = True):
+            
+            if factor == 1:
+                return self.levels[1].overlaps(other.levels[1], offset)
+            
+            if xOffset % factor or zOffset % factor:
+                # Cells of <other> then straddle two cells of self
+                cells = other.dilated(factor)
+            else:
+                cells = other.level(factor)
+            
+            if not self.level(factor).overlaps(cells, (xOffset // factor, zOffset // factor)):
+                return False
@@ -1,7 +1,43 @@
+from .instrumentation import metrics
 from abc import ABC, abstractmethod
+import sys
 
 class Cache(ABC):
-    """Defines basic functions for objects that use a cache"""
+    """Defines basic functions for objects that use a cache
+    
+    The cache can be bounded by entry count and / or total size.
+    When it grows past its limits, least recently used entries are evicted.
+    Evicted entries are saved if they are dirty, and simply dropped otherwise.
+    """
+    
+    def __init__(self, maxSize : int = None, maxBytes : int = None):
+        
+        self._assigned = set()
+        """Keys of entries set directly, which are saved even if is_dirty cannot tell they changed"""
+        
+        self._bytes = 0
+        """Sum of self._sizes, kept up to date so that evict does not add them up again"""
+        
+        self._cache = {}
+        """Loaded entries, from least to most recently used"""
+        
+        self._sizes = {}
+        """Size of each loaded entry, as returned by self.sizeof"""
+        
+        self.maxSize = maxSize
+        """Maximum number of entries in cache, or None for no limit"""
+        
+        self.maxBytes = maxBytes
+        """Maximum total size of entries in cache, or None for no limit"""
+        
+        self.hits = 0
+        """Number of lookups served from cache"""
+        
+        self.misses = 0
+        """Number of lookups which had to load their entry"""
+        
+        self.evictions = 0
+        """Number of entries evicted to stay within limits"""
     
     def __delitem__(self, key):
         """Remove entry <key> from cache"""
@@ -12,7 +48,21 @@ class Cache(ABC):
         """Return entry <key> from cache, load if absent"""
         key = self.convert_key(key = key)
         
-        if key not in self._cache:
+        # Metrics are checked here rather than in count, as blocks are looked up far too often for a wasted call
+        if key in self._cache:
+            self.hits += 1
+            self._cache[key] = self._cache.pop(key)
+            if metrics.enabled:
+                metrics.count('cache_hits_total', cache = type(self).__name__)
+            
+            if self.maxBytes is not None:
+                # Entries can grow while cached, as their own contents are loaded
+                self.resize(key)
+                self.evict()
+        else:
+            self.misses += 1
+            if metrics.enabled:
+                metrics.count('cache_misses_total', cache = type(self).__name__)
             self.load(key)
         
         return self._cache[key]
@@ -20,27 +70,71 @@ class Cache(ABC):
     def __setitem__(self, key, value):
         """Set data in cache for entry <key> to <value>"""
         key = self.convert_key(key = key)
-        self._cache[key] = self.convert_value(value = value)
+        value = self.convert_value(value = value)
+        self._assigned.add(key)
+        self.store(key, value)
     
     def discard(self, key):
         """Discard cache entry <key>"""
         key = self.convert_key(key = key)
         del self._cache[key]
+        self._bytes -= self._sizes.pop(key, 0)
+        self._assigned.discard(key)
     
     def discard_all(self):
         """Discard all cache entries"""
+        self._assigned = set()
+        self._bytes = 0
         self._cache = {}
+        self._sizes = {}
+    
+    def evict(self):
+        """Evict least recently used entries until the cache is within its limits
+        
+        The most recently used entry is always kept
+        """
+        while len(self._cache) > 1 and (
+               (self.maxSize is not None and len(self._cache) > self.maxSize)
+            or (self.maxBytes is not None and self._bytes > self.maxBytes)
+        ):
+            key = next(iter(self._cache))
+            value = self._cache[key]
+            
+            if self.needs_save(key = key, value = value):
+                self.save_value(key = key, value = value)
+            
+            self.discard(key)
+            self.evictions += 1
+            if metrics.enabled:
+                metrics.count('cache_evictions_total', cache = type(self).__name__)
+    
+    def is_dirty(self, key, value):
+        """Whether cached <value> for entry <key> has changes that need saving
+        
+        Assumes every entry is dirty, subclasses which can tell should override this
+        """
+        return True
     
     def load(self, key):
         """Load data for entry <key> into cache"""
         key = self.convert_key(key = key)
-        self._cache[key] = self.load_value(key)
+        self.store(key, self.load_value(key))
 
     @abstractmethod
     def load_value(self, key):
         """Return data for entry <key> from underlying data source"""
         pass
 
+    def needs_save(self, key, value):
+        """Whether cached <value> for entry <key> was set directly or is dirty"""
+        return key in self._assigned or self.is_dirty(key = key, value = value)
+    
+    def resize(self, key):
+        """Measure entry <key> again with self.sizeof, after it changed size"""
+        size = self.sizeof(self._cache[key])
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+    
     def save(self, key):
         """Save changes for enty <key> and remove it from cache"""
         key = self.convert_key(key = key)
@@ -48,16 +142,37 @@ class Cache(ABC):
         if key not in self._cache:
             return
         
-        self.save_value(key = key, value = self._cache[key])
+        if self.needs_save(key = key, value = self._cache[key]):
+            self.save_value(key = key, value = self._cache[key])
+        
         self.discard(key)
     
     def save_all(self):
-        """Save all changes in self._cache"""
+        """Save all changes in self._cache, skipping entries that are not dirty"""
         for key in self._cache:
-            self.save_value(key = key, value = self._cache[key])
+            if self.needs_save(key = key, value = self._cache[key]):
+                self.save_value(key = key, value = self._cache[key])
         
         self.discard_all()
     
+    def sizeof(self, value):
+        """Return size of <value> counted against self.maxBytes
+        
+        Defaults to sys.getsizeof, which does not account for referenced objects.
+        Subclasses using maxBytes should override this.
+        """
+        return sys.getsizeof(value)
+    
+    def store(self, key, value):
+        """Put <value> in cache as most recently used entry <key>, evict entries if needed"""
+        self._cache.pop(key, None)
+        self._cache[key] = value
+        
+        if self.maxBytes is not None:
+            self.resize(key)
+        
+        self.evict()
+    
     @abstractmethod
     def convert_key(self, key):
         """Return converted <key> for use with this Cache subclass.
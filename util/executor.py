@@ -0,0 +1,132 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+
+def run_batch(function, batch):
+    """Return [function(*args) for args in <batch>]
+    
+    Module-level so that batches can be sent to worker processes
+    """
+    return [function(*args) for args in batch]
+
+class Executor():
+    """A long-lived pool of workers, meant to be shared by everything in a run
+    
+    The underlying pool is only started when first needed, so creating an Executor is free.
+    It is not pickled along with objects holding it, so those can still be sent to workers.
+    """
+    
+    __slots__ = ['_pid', '_pool', '_poolWorkers', 'kind', 'maxPending', 'workers']
+    
+    _default = None
+    """Executor used by objects which were not given one"""
+    
+    kinds = {
+        'process' : concurrent.futures.ProcessPoolExecutor,
+        'thread'  : concurrent.futures.ThreadPoolExecutor
+    }
+    """Supported kinds of pool"""
+    
+    def __init__(self, kind : str = 'process', workers : int = None, maxPending : int = None):
+        
+        if kind not in self.kinds:
+            raise ValueError(f'Kind must be one of {list(self.kinds)}, not {kind}')
+        
+        self._pid = None
+        """Process which started the pool. Forked processes inherit the pool, but not its workers"""
+        
+        self._pool = None
+        """Underlying concurrent.futures pool, started on first use"""
+        
+        self._poolWorkers = None
+        """Number of workers of the running pool, <workers> or the default it was resolved to"""
+        
+        self.kind = kind
+        """Whether to use a process or thread pool"""
+        
+        self.maxPending = maxPending
+        """Maximum number of tasks submitted but not yet consumed by map, defaults to twice the workers"""
+        
+        self.workers = workers
+        """Number of workers, defaults to concurrent.futures' default"""
+    
+    def __enter__(self):
+        """Return self"""
+        return self
+    
+    def __exit__(self, exc_type = None, exc_value = None, traceback = None):
+        """Stop all workers"""
+        self.shutdown()
+    
+    def __getstate__(self):
+        return self.kind, self.maxPending, self.workers
+    
+    def __repr__(self):
+        return f'Executor ({self.kind}, {self.workers or "default"} workers)'
+    
+    def __setstate__(self, state):
+        self.kind, self.maxPending, self.workers = state
+        self._pid = None
+        self._pool = None
+        self._poolWorkers = None
+    
+    @classmethod
+    def default(cls):
+        """Return the Executor shared by objects which were not given one"""
+        if Executor._default is None:
+            Executor._default = cls()
+        return Executor._default
+    
+    def map(self, function, *iterables, chunksize : int = 1):
+        """Like concurrent.futures.Executor.map, but with backpressure
+        
+        Arguments are only consumed as results are, so that at most <maxPending> batches
+        of <chunksize> tasks are in flight at any time, even for very long iterables.
+        Results are yielded in order.
+        """
+        pool = self.pool
+        maxPending = self.maxPending or 2 * self._poolWorkers
+        pending = collections.deque()
+        arguments = zip(*iterables)
+        
+        while True:
+            
+            while len(pending) < maxPending:
+                batch = list(itertools.islice(arguments, chunksize))
+                if batch == []:
+                    break
+                pending.append(pool.submit(run_batch, function, batch))
+            
+            if len(pending) == 0:
+                break
+            
+            for result in pending.popleft().result():
+                yield result
+    
+    @property
+    def pool(self):
+        """Underlying concurrent.futures pool, started if needed"""
+        if self._pool is None or self._pid != os.getpid():
+            
+            if self.workers is not None:
+                self._poolWorkers = self.workers
+            elif self.kind == 'process':
+                self._poolWorkers = os.cpu_count() or 1
+            else:
+                # Same default as concurrent.futures.ThreadPoolExecutor
+                self._poolWorkers = min(32, (os.cpu_count() or 1) + 4)
+            
+            self._pid = os.getpid()
+            self._pool = self.kinds[self.kind](max_workers = self._poolWorkers)
+        return self._pool
+    
+    def shutdown(self, wait : bool = True):
+        """Stop all workers. They will be started again if this Executor is used later"""
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait = wait)
+            self._pool = None
+    
+    def submit(self, function, *args, **kwargs):
+        """Schedule function(*args, **kwargs) and return a concurrent.futures.Future"""
+        return self.pool.submit(function, *args, **kwargs)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import contextlib
+import os
+import shutil
+import struct
+import tempfile
+
+@contextlib.contextmanager
+def atomic_write(path : str, mode : str = 'wb', **kwargs):
+    """Open a temporary file next to <path>, which replaces <path> only once fully written
+    
+    If anything goes wrong before the end of the with block, <path> is left untouched
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    handle, tempPath = tempfile.mkstemp(dir = folder, prefix = f'{name}.', suffix = '.tmp')
+    
+    try:
+        if os.path.exists(path):
+            shutil.copymode(path, tempPath)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tempPath, 0o666 & ~umask)
+        
+        with open(handle, mode = mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        
+        os.replace(tempPath, path)
+    
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tempPath)
+        raise
+
+class Journal():
+    """Undo journal protecting in-place writes to a file
+    
+    Bytes about to be overwritten are saved to <path>.journal before the file is touched.
+    If a write is interrupted, rollback restores the file as it was before the write began.
+    """
+    
+    __slots__ = ['path']
+    
+    suffix = '.journal'
+    """Appended to the path of the protected file to get the journal's path"""
+    
+    terminator = b'JOURNAL\x00'
+    """Marks the end of a complete journal"""
+    
+    def __init__(self, path : str):
+        
+        self.path = path
+        """Path of the protected file"""
+    
+    def __repr__(self):
+        return f'Journal of {self.path}'
+    
+    def begin(self, f, ranges):
+        """Save bytes of open file <f> in (start, end) <ranges> before they are overwritten"""
+        
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        
+        with open(self.journalPath, mode = 'wb') as journal:
+            
+            journal.write(struct.pack('>Q', size))
+            
+            for start, end in ranges:
+                end = min(end, size)
+                if start >= end:
+                    continue
+                
+                f.seek(start)
+                journal.write(struct.pack('>QI', start, end - start))
+                journal.write(f.read(end - start))
+            
+            # Only mark the journal as complete once everything else is on disk
+            journal.flush()
+            os.fsync(journal.fileno())
+            journal.write(self.terminator)
+            journal.flush()
+            os.fsync(journal.fileno())
+    
+    def commit(self):
+        """Forget saved bytes once the protected file is fully written"""
+        os.remove(self.journalPath)
+    
+    @property
+    def journalPath(self):
+        """Path of the journal file"""
+        return self.path + self.suffix
+    
+    def rollback(self):
+        """Restore the protected file if a journal was left behind, return whether it was"""
+        
+        if not os.path.exists(self.journalPath):
+            return False
+        
+        with open(self.journalPath, mode = 'rb') as journal:
+            data = journal.read()
+        
+        if data.endswith(self.terminator) and os.path.exists(self.path):
+            
+            size, = struct.unpack_from('>Q', data)
+            pos = 8
+            
+            with open(self.path, mode = 'r+b') as f:
+                
+                while pos < len(data) - len(self.terminator):
+                    start, length = struct.unpack_from('>QI', data, pos)
+                    pos += 12
+                    f.seek(start)
+                    f.write(data[pos : pos + length])
+                    pos += length
+                
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+        
+        # An incomplete journal means the protected file was never touched
+        os.remove(self.journalPath)
+        return True
\ No newline at end of file
@@ -0,0 +1,250 @@
+import bisect
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+class Histogram():
+    """Count of observed values falling in each bucket, along with their sum"""
+    
+    __slots__ = ['buckets', 'count', 'counts', 'sum']
+    
+    def __init__(self, buckets : list):
+        
+        self.buckets = buckets
+        """Sorted upper bounds of buckets, values above the last one fall in an extra bucket"""
+        
+        self.count = 0
+        """Number of observed values"""
+        
+        self.counts = [0] * (len(buckets) + 1)
+        """Number of observed values in each bucket, not cumulative"""
+        
+        self.sum = 0
+        """Sum of observed values"""
+    
+    def __repr__(self):
+        return f'Histogram of {self.count} values, sum {self.sum}'
+    
+    def observe(self, value):
+        """Add <value> to its bucket"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class Span():
+    """Context manager observing how many seconds its with block took"""
+    
+    __slots__ = ['labels', 'metrics', 'name', 'start']
+    
+    def __init__(self, metrics, name : str, labels : dict):
+        
+        self.labels = labels
+        """Labels of the observed histogram"""
+        
+        self.metrics = metrics
+        """Metrics holding the observed histogram"""
+        
+        self.name = name
+        """Name of the observed histogram"""
+        
+        self.start = None
+        """time.perf_counter() when the with block was entered"""
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type = None, exc_value = None, traceback = None):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class Metrics():
+    """Counters and histograms, labelled like Prometheus metrics
+    
+    Everything is a no-op while disabled, so that instrumented code costs next to nothing.
+    Each process has its own metrics, see map for those of worker processes.
+    """
+    
+    __slots__ = ['_lock', 'counters', 'enabled', 'histograms']
+    
+    nullSpan = contextlib.nullcontext()
+    """Returned by span while disabled"""
+    
+    sizeBuckets = [4 ** i for i in range(3, 14)]
+    """Histogram buckets for sizes in bytes, from 64 bytes to 64 MiB"""
+    
+    timeBuckets = [10 ** i for i in range(-5, 2)]
+    """Histogram buckets for durations in seconds, from 10 µs to 10 s"""
+    
+    def __init__(self, enabled : bool = False):
+        
+        self._lock = threading.Lock()
+        """Held while updating, as thread pools record from several threads"""
+        
+        self.counters = {}
+        """Counter values by (name, labels)"""
+        
+        self.enabled = enabled
+        """Whether anything is recorded"""
+        
+        self.histograms = {}
+        """Histograms by (name, labels)"""
+    
+    def __repr__(self):
+        return f'Metrics ({"enabled" if self.enabled else "disabled"}, {len(self.counters)} counters, {len(self.histograms)} histograms)'
+    
+    def count(self, name : str, value : int = 1, **labels):
+        """Add <value> to counter <name>"""
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                self.counters[key] = self.counters.get(key, 0) + value
+    
+    def map(self, executor, function, *iterables):
+        """Like <executor>.map, merging metrics recorded by <function> in worker processes into self
+        
+        <function> must be module-level, so that it can be sent to worker processes
+        """
+        if not self.enabled:
+            yield from executor.map(function, *iterables)
+            return
+        
+        for result, recorded in executor.map(
+            measure,
+            itertools.repeat(os.getpid()),
+            itertools.repeat(function),
+            *iterables
+        ):
+            if recorded is not None:
+                self.merge(recorded)
+            yield result
+    
+    def merge(self, recorded : dict):
+        """Add counters and histograms from <recorded>, as returned by to_dict"""
+        with self._lock:
+            
+            for counter in recorded['counters']:
+                key = (counter['name'], tuple(sorted(counter['labels'].items())))
+                self.counters[key] = self.counters.get(key, 0) + counter['value']
+            
+            for histogram in recorded['histograms']:
+                key = (histogram['name'], tuple(sorted(histogram['labels'].items())))
+                
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(histogram['buckets'])
+                
+                if self.histograms[key].buckets != histogram['buckets']:
+                    raise ValueError(f'Cannot merge histogram {histogram["name"]} with different buckets')
+                
+                self.histograms[key].counts = [a + b for a, b in zip(self.histograms[key].counts, histogram['counts'])]
+                self.histograms[key].count += histogram['count']
+                self.histograms[key].sum += histogram['sum']
+    
+    def observe(self, name : str, value, buckets : list = None, **labels):
+        """Add <value> to histogram <name>, created with <buckets> or timeBuckets if it does not exist yet"""
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(buckets or self.timeBuckets)
+                self.histograms[key].observe(value)
+    
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+    
+    def span(self, name : str, **labels):
+        """Return a context manager observing the duration of its with block in histogram <name>"""
+        if self.enabled:
+            return Span(self, name, labels)
+        return self.nullSpan
+    
+    def to_dict(self):
+        """Return everything recorded as a dict of JSON-compatible lists of 'counters' and 'histograms'"""
+        with self._lock:
+            return {
+                'counters' : [
+                    {'name' : name, 'labels' : dict(labels), 'value' : value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms' : [
+                    {
+                        'name' : name,
+                        'labels' : dict(labels),
+                        'buckets' : histogram.buckets,
+                        'counts' : histogram.counts,
+                        'count' : histogram.count,
+                        'sum' : histogram.sum
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ]
+            }
+    
+    def to_json(self, **kwargs):
+        """Return everything recorded as JSON, see to_dict. <kwargs> are passed to json.dumps"""
+        return json.dumps(self.to_dict(), **kwargs)
+    
+    def to_prometheus(self, prefix : str = 'infinifuse_'):
+        """Return everything recorded in Prometheus text exposition format, every name starting with <prefix>"""
+        
+        def format_labels(labels : dict, **extra):
+            """Return {name="value",...} for <labels> and <extra>, or an empty string if there are none"""
+            labels = {**labels, **extra}
+            if labels == {}:
+                return ''
+            escaped = [
+                (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                for key, value in labels.items()
+            ]
+            return '{' + ','.join([f'{key}="{value}"' for key, value in escaped]) + '}'
+        
+        recorded = self.to_dict()
+        lines = []
+        
+        for counter in recorded['counters']:
+            name = prefix + counter['name']
+            if f'# TYPE {name} counter' not in lines:
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{format_labels(counter["labels"])} {counter["value"]}')
+        
+        for histogram in recorded['histograms']:
+            name = prefix + histogram['name']
+            if f'# TYPE {name} histogram' not in lines:
+                lines.append(f'# TYPE {name} histogram')
+            
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(histogram["labels"], le = bound)} {cumulative}')
+            
+            lines.append(f'{name}_sum{format_labels(histogram["labels"])} {histogram["sum"]}')
+            lines.append(f'{name}_count{format_labels(histogram["labels"])} {histogram["count"]}')
+        
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+"""Metrics shared by everything in a process, disabled until <metrics>.enabled is set"""
+
+def measure(pid : int, function, *args):
+    """Return function(*args) and the metrics it recorded, see Metrics.to_dict
+    
+    Metrics are only returned when running in another process than <pid>,
+    as those recorded in process <pid> itself already are where they belong.
+    Module-level so that it can be sent to worker processes, which run a single task at a time.
+    """
+    if os.getpid() == pid:
+        return function(*args), None
+    
+    enabled = metrics.enabled
+    metrics.enabled = True
+    metrics.reset()
+    try:
+        result = function(*args)
+    finally:
+        metrics.enabled = enabled
+    
+    return result, metrics.to_dict()